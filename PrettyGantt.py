@@ -28,11 +28,28 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import os, json, itertools
-import altair as alt
+import os, json, hashlib, tempfile, threading, time, mmap, functools, collections
+import concurrent.futures, multiprocessing, asyncio
 import datetime as dt
+import numpy as np
 import pandas as pd
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Altair is only needed to build charts, it is imported by LoadAltair() on first use so
+# that loading and validating schedules doesn't pay for it
+alt = None
+
+def LoadAltair():
+    global alt
+    if (alt is None):
+        import altair
+        alt = altair
+    return alt
+
 # Overall layout
 GRAPH_WIDTH = 800
 GRAPH_BAR_HEIGHT = 10
@@ -45,9 +62,37 @@ EVENT_DESC_OFFSET_Y = 15
 EVENT_DATE_DESC_OFFSET_X = 5
 EVENT_DATE_DESC_OFFSET_Y = 24
 
+# Header band granularities: Year, Half-year, Quarter, Month, Week (Monday to Sunday)
+BAND_NAMES = {'Y': 'Year', 'H': 'Half', 'Q': 'Quarter', 'M': 'Month', 'W': 'Week'}
+BAND_MONTHS = {'Y': 12, 'H': 6, 'Q': 3, 'M': 1}
+
+def PeriodStart(now, unit, shift = 0):
+    # First day of the unit period containing now, moved by shift periods
+    now = pd.Timestamp(now).normalize()
+    if (unit == 'W'):
+        return now - pd.Timedelta(days = now.dayofweek - 7 * shift)
+    months = BAND_MONTHS[unit]
+    month = (now.month - 1) // months * months + 1
+    return pd.Timestamp(now.year, month, 1) + pd.DateOffset(months = months * shift)
+
+def PeriodWindow(now = None, unit = 'Q', before = 1, after = 3):
+    """Range from the period before periods ago to the end of the one after periods ahead."""
+    now = pd.Timestamp.today() if (now is None) else pd.Timestamp(now)
+    return (PeriodStart(now, unit, -before).strftime('%Y-%m-%d'),
+            (PeriodStart(now, unit, after + 1) - pd.Timedelta(days = 1)).strftime('%Y-%m-%d'))
+
 # Only plot 5 quarters: [-1, +4]
-RANGE_START = (pd.Timestamp.today() - pd.tseries.offsets.QuarterEnd(2) + pd.Timedelta(days = 1)).strftime('%Y-%m-%d')
-RANGE_END = (pd.Timestamp.today() + pd.tseries.offsets.QuarterEnd(4)).strftime('%Y-%m-%d')
+def QuarterWindow(now = None):
+    return PeriodWindow(now, 'Q', 1, 3)
+
+def __getattr__(name):
+    # RANGE_START/RANGE_END used to be fixed at import time, now they follow the current date.
+    # Assigning PrettyGantt.RANGE_START still pins the window for every new RenderContext.
+    if (name == 'RANGE_START'):
+        return QuarterWindow()[0]
+    if (name == 'RANGE_END'):
+        return QuarterWindow()[1]
+    raise AttributeError('module %r has no attribute %r' %(__name__, name))
 
 # Chart background and text color
 CHART_COLOR_BG = '#E7EFF1'
@@ -57,62 +102,275 @@ TODAY_COLOR = '#43C59E'
 # Chart header (quarter & month) color
 QUARTER_COLOR_BG = '#000000'
 QUARTER_COLOR_FG = '#FFFFFF'
-MONTH_COLOR_BG = itertools.cycle(['#A3B0BB', '#60696B'])
+MONTH_COLOR_BG = ['#A3B0BB', '#60696B'] # Alternate by month position in the range
 MONTH_COLOR_FG = '#000000'
+# Upper and lower header rows, colored as quarter and month above
+HEADER_BANDS = ('Q', 'M')
 
-class ProgramChart():
-    head_bar_list_q = []
-    head_bar_list_m = []
-    chart_today = None
-    chart_header = []
-    chart_program = []
+class RenderContext():
+    """Range window, today's date and color scheme used to process and plot one schedule.
+
+    Anything not given falls back to the module level settings at creation
+    time. The range window and today are derived from now, the current time
+    unless injected, window = (unit, before, after) as for PeriodWindow. bands
+    picks the upper and lower header rows among BAND_NAMES. A context is never
+    modified afterwards, so charts built on different threads can share one.
+    """
+
+    def __init__(self, range_start = None, range_end = None, today = None,
+                 chart_color_bg = None, chart_color_fg = None, today_color = None,
+                 quarter_color_bg = None, quarter_color_fg = None,
+                 month_color_bg = None, month_color_fg = None, now = None,
+                 window = None, bands = None):
+        now = pd.Timestamp.today() if (now is None) else pd.Timestamp(now)
+        window = PeriodWindow(now, *window) if (window is not None) else QuarterWindow(now)
+        self.range_start = range_start or globals().get('RANGE_START') or window[0]
+        self.range_end = range_end or globals().get('RANGE_END') or window[1]
+        self.today = today or now.strftime('%Y-%m-%d')
+        self.chart_color_bg = chart_color_bg or CHART_COLOR_BG
+        self.chart_color_fg = chart_color_fg or CHART_COLOR_FG
+        self.today_color = today_color or TODAY_COLOR
+        self.quarter_color_bg = quarter_color_bg or QUARTER_COLOR_BG
+        self.quarter_color_fg = quarter_color_fg or QUARTER_COLOR_FG
+        self.month_color_bg = tuple(month_color_bg or MONTH_COLOR_BG)
+        self.month_color_fg = month_color_fg or MONTH_COLOR_FG
+        self.bands = tuple(bands or HEADER_BANDS)
+        if ((len(self.bands) != 2) or any(unit not in BAND_NAMES for unit in self.bands)):
+            raise ValueError('Header bands must be two of %s' %(', '.join(BAND_NAMES)))
+
+class ScheduleError(Exception):
+    """Invalid schedule JSON or content, raised instead of exiting so batch callers can go on."""
+    pass
+
+# Installed stage hooks. Replaced rather than modified, so a render can iterate it without a lock.
+stage_hooks = ()
+stage_hooks_lock = threading.Lock()
+
+def AddStageHook(hook):
+    """Call hook(stage, seconds, info) after every instrumented stage.
+
+    stage is the method or function name (ParseDataFromJSON, ProcessProgramDetails,
+    PrepareChartHeader, the Plot* methods, BuildSpec, Render, PlotGantt, ...).
+    Stages nest, PlotChartHeader for example includes PlotMonthQuarterBlock. info
+    has the row counts known at the end of the stage (programs, phases, events),
+    spec_bytes after BuildSpec and output_bytes after Render and PlotSave.
+    """
+    global stage_hooks
+    with stage_hooks_lock:
+        stage_hooks = stage_hooks + (hook,)
+
+def RemoveStageHook(hook):
+    global stage_hooks
+    with stage_hooks_lock:
+        stage_hooks = tuple(h for h in stage_hooks if (h is not hook))
+
+class StageHook():
+    """Install a hook for the duration of a with block."""
+
+    def __init__(self, hook):
+        self.hook = hook
+
+    def __enter__(self):
+        AddStageHook(self.hook)
+        return self.hook
+
+    def __exit__(self, *exc):
+        RemoveStageHook(self.hook)
+        return False
+
+def StageInfo(owner, result):
+    info = {}
+    ps = getattr(owner, 'ps', owner)
+    columns = getattr(ps, 'program_columns', None)
+    for key, table, column in (('programs', 'program_bar_name_table', 'program'),
+                               ('phases', 'program_bar_range_table', 'phase_row'),
+                               ('events', 'program_bar_event_table', 'event_row')):
+        df = getattr(ps, table, None)
+        if (df is not None):
+            info[key] = len(df)
+        elif (columns is not None):
+            # Parsed but not processed yet
+            info[key] = len(getattr(columns, column))
+    if (isinstance(result, dict) and ('datasets' in result)):
+        info['spec_bytes'] = len(json.dumps(result))
+    elif (isinstance(result, bytes)):
+        info['output_bytes'] = len(result)
+    return info
+
+def Instrumented(func):
+    # Reports the call to stage hooks, a single check when none are installed
+    @functools.wraps(func)
+    def Wrapper(*args, **kwargs):
+        if (not stage_hooks):
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        info = StageInfo(args[0] if (args) else None, result)
+        for hook in stage_hooks:
+            try:
+                hook(func.__name__, seconds, info)
+            except Exception as err:
+                # A broken metrics hook must not fail the render
+                print('Stage hook %r failed: %s' %(hook, err))
+        return result
+    return Wrapper
+
+class StageMetrics():
+    """Stage hook that aggregates durations and sizes across many renders.
+
+    Keeps the last max_samples durations of each stage for percentiles, plus
+    running counts and sums. Thread safe, install with AddStageHook(metrics).
+    """
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, max_samples = 10000):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.count = collections.Counter()
+        self.seconds = collections.Counter()
+        self.rows = collections.Counter()
+        self.spec_bytes = []
+
+    def __call__(self, stage, seconds, info):
+        with self.lock:
+            if (stage not in self.samples):
+                self.samples[stage] = collections.deque(maxlen = self.max_samples)
+            self.samples[stage].append(seconds)
+            self.count[stage] += 1
+            self.seconds[stage] += seconds
+            for key in ('programs', 'phases', 'events'):
+                if (key in info):
+                    self.rows[(stage, key)] += info[key]
+            if ('spec_bytes' in info):
+                self.spec_bytes.append(info['spec_bytes'])
+                del self.spec_bytes[:-self.max_samples]
+
+    def Percentiles(self, stage, quantiles = QUANTILES):
+        with self.lock:
+            samples = np.array(self.samples.get(stage, ()))
+        if (len(samples) == 0):
+            return {q: None for q in quantiles}
+        return dict(zip(quantiles, np.quantile(samples, quantiles).tolist()))
+
+    def Summary(self):
+        return {stage: {'count': self.count[stage], 'seconds': self.seconds[stage], 'quantiles': self.Percentiles(stage)}
+                for stage in sorted(self.samples)}
+
+    def PrometheusText(self, prefix = 'prettygantt'):
+        lines = ['# HELP %s_stage_seconds Duration of PrettyGantt stages.' %(prefix),
+                 '# TYPE %s_stage_seconds summary' %(prefix)]
+        for stage, summary in self.Summary().items():
+            for q, value in summary['quantiles'].items():
+                lines.append('%s_stage_seconds{stage="%s",quantile="%g"} %r' %(prefix, stage, q, value))
+            lines.append('%s_stage_seconds_sum{stage="%s"} %r' %(prefix, stage, summary['seconds']))
+            lines.append('%s_stage_seconds_count{stage="%s"} %d' %(prefix, stage, summary['count']))
+        lines += ['# HELP %s_stage_rows_total Rows handled by PrettyGantt stages.' %(prefix),
+                  '# TYPE %s_stage_rows_total counter' %(prefix)]
+        with self.lock:
+            rows = sorted(self.rows.items())
+            spec_bytes = np.array(self.spec_bytes)
+        for (stage, key), value in rows:
+            lines.append('%s_stage_rows_total{stage="%s",table="%s"} %d' %(prefix, stage, key, value))
+        lines += ['# HELP %s_spec_bytes Size of built Vega-Lite specs.' %(prefix),
+                  '# TYPE %s_spec_bytes summary' %(prefix)]
+        if (len(spec_bytes)):
+            for q, value in zip(self.QUANTILES, np.quantile(spec_bytes, self.QUANTILES).tolist()):
+                lines.append('%s_spec_bytes{quantile="%g"} %r' %(prefix, q, value))
+            lines.append('%s_spec_bytes_sum %d' %(prefix, spec_bytes.sum()))
+        lines.append('%s_spec_bytes_count %d' %(prefix, len(spec_bytes)))
+        return '\n'.join(lines) + '\n'
+
+    def WritePrometheus(self, path, prefix = 'prettygantt'):
+        # Atomic replace, so a textfile collector never reads a partial file
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.PrometheusText(prefix))
+        os.replace(tmp, path)
 
-    def __init__(self, ps):
+class ProgramChart():
+    def __init__(self, ps, context = None, prune_columns = True):
+        LoadAltair()
         self.ps = ps
         self.name = ps.description
+        self.context = context or ps.context
+        self.prune_columns = prune_columns
+        # All state is per chart, nothing is shared with other charts
+        self.header_band = None
+        self.head_bar_table = None
+        self.chart_today = None
+        self.chart_header = []
+        self.chart_program = []
+        self.data_columns = {}
+
+    def ChartTables(self):
+        return {'header': self.head_bar_table,
+                'today': pd.DataFrame({'Date': [self.context.today], 'Color': [self.context.today_color]}),
+                'program': self.ps.program_bar_name_table,
+                'phase': self.ps.program_bar_range_table,
+                'event': self.ps.program_bar_event_table}
+
+    def ChartData(self, name, columns):
+        # Layers refer to a table by name, so it is serialized once into the top-level
+        # datasets however many layers use it. Only the columns some layer uses are kept.
+        used = self.data_columns.setdefault(name, [])
+        for column in columns:
+            if (column not in used):
+                used.append(column)
+        return alt.NamedData(name = name)
+
+    def ChartDatasets(self, data_columns = None):
+        data_columns = data_columns or self.data_columns
+        tables = self.ChartTables()
+        datasets = {}
+        for name, used in data_columns.items():
+            table = tables[name]
+            if (self.prune_columns):
+                table = table[[column for column in table.columns if column in used]]
+            if ((name == 'header') and (self.header_band is not None)):
+                datasets[name] = self.header_band.Values(tuple(table.columns))
+            else:
+                datasets[name] = DatasetValues(table)
+        return datasets
+
+    # Per schedule values in the layout, SpecTemplate substitutes them after compiling
+    def ChartTitle(self):
+        return self.name
+
+    def RangeDomain(self):
+        return [self.context.range_start, self.context.range_end]
+
+    def ChartHeight(self):
+        return GRAPH_BAR_SPACE * len(self.ps.program_bar_name_table)
+
+    def PhaseLegend(self):
+        return [p['Description'] for p in self.ps.phases], [p['BGColor'] for p in self.ps.phases]
 
-    def PrepareQuarterHeader(self):
-        self.head_bar_list_q = []
-        for quarter in pd.date_range(RANGE_START, RANGE_END, freq = 'QS'):
-            q_start = quarter.strftime('%Y-%m-%d')
-            q_end = (quarter + pd.tseries.offsets.QuarterEnd(1)).strftime('%Y-%m-%d')
-            q_entry = {'Program': 'Quarter',
-                       'Index': 0,
-                       'Start': pd.to_datetime(q_start),
-                       'End': pd.to_datetime(q_end),
-                       'BGColor': QUARTER_COLOR_BG,
-                       'FGColor': QUARTER_COLOR_FG,
-                       'Description': str(quarter.year) + 'Q' + str(quarter.quarter)
-                       }
-            self.head_bar_list_q.append(q_entry)
-
-    def PrepareMonthHeader(self):
-        self.head_bar_list_m = []
-        for month in pd.date_range(RANGE_START, RANGE_END, freq = 'MS'):
-            m_start = month.strftime('%Y-%m-%d')
-            m_end = (month + pd.tseries.offsets.MonthEnd(1)).strftime('%Y-%m-%d')
-            m_entry = {'Program': 'Month',
-                    'Index': 1,
-                    'Start': pd.to_datetime(m_start),
-                    'End': pd.to_datetime(m_end),
-                    'BGColor': next(MONTH_COLOR_BG),
-                    'FGColor': MONTH_COLOR_FG,
-                    'Description': month.strftime('%m')}
-            self.head_bar_list_m.append(m_entry)
+    def EventLegend(self):
+        return [e['Description'] for e in self.ps.events], [e['BGColor'] for e in self.ps.events]
 
+    @Instrumented
     def PrepareChartHeader(self):
-        self.PrepareQuarterHeader()
-        self.PrepareMonthHeader()
+        # Shared by every chart with the same window, bands and header colors
+        self.header_band = GetHeaderBand(self.context)
+        self.head_bar_table = self.header_band.table
 
+    def ShareChartHeader(self, pc):
+        # Pages of one schedule reuse the header prepared for the first page
+        self.header_band = pc.header_band
+        self.head_bar_table = pc.head_bar_table
+
+    @Instrumented
     def PlotMonthQuarterBlock(self):
         self.chart_header.append(
-            alt.Chart(pd.DataFrame(self.head_bar_list_q + self.head_bar_list_m)).mark_bar(
+            alt.Chart(self.ChartData('header', ['Start', 'End', 'Index', 'BGColor'])).mark_bar(
                     opacity = GRAPH_BAR_OPACITY,
                     cornerRadius = 5
                 ).encode(
-                x = alt.X('Start',
-                        scale = alt.Scale(domain = [RANGE_START, RANGE_END]),
-                        axis = alt.Axis(title = self.name,
+                x = alt.X('Start:T',
+                        scale = alt.Scale(domain = self.RangeDomain()),
+                        axis = alt.Axis(title = self.ChartTitle(),
                                         labelAngle = 0,
                                         format = ('%m'),
                                         tickCount = {'interval': 'month', 'step': 1},
@@ -120,7 +378,7 @@ class ProgramChart():
                                         labels = False,
                                         ticks = False,
                                         ),
-                        timeUnit = 'yearmonth',
+                        timeUnit = 'yearmonthdate',
                     ),
                 x2 = 'End',
                 y = alt.Y('Index:N',
@@ -134,56 +392,55 @@ class ProgramChart():
             ).properties(width = GRAPH_WIDTH)
         )
 
+    @Instrumented
     def PlotQuarterText(self):
         self.chart_header.append(
-            alt.Chart(pd.DataFrame(self.head_bar_list_q)).mark_text(dx = 80, align = 'center', color = QUARTER_COLOR_FG).encode(
-                      x = 'Start',
-                      x2 = 'End',
+            alt.Chart(self.ChartData('header', ['Middle', 'Index', 'Description'])).mark_text(align = 'center', color = self.context.quarter_color_fg).encode(
+                      x = 'Middle:T',
                       y = 'Index:N',
                       detail = 'site:N',
-                      text = alt.Text('Description')
-                      )
+                      text = alt.Text('Description:N')
+                      ).transform_filter(alt.datum.Index == 0)
         )
 
+    @Instrumented
     def PlotMonthText(self):
         self.chart_header.append(
-            alt.Chart(pd.DataFrame(self.head_bar_list_m)).mark_text(dx = 25, align = 'center', color = MONTH_COLOR_FG).encode(
-                      x = 'Start',
-                      x2 = 'End',
+            alt.Chart(self.ChartData('header', ['Middle', 'Index', 'Description'])).mark_text(align = 'center', color = self.context.month_color_fg).encode(
+                      x = 'Middle:T',
                       y = 'Index:N',
                       detail = 'site:N',
-                      text = alt.Text('Description')
-                      )
+                      text = alt.Text('Description:N')
+                      ).transform_filter(alt.datum.Index == 1)
         )
 
+    @Instrumented
     def PlotChartToday(self):
-        self.chart_today = alt.Chart(pd.DataFrame({'Date': [pd.Timestamp.today().strftime('%Y-%m-%d')], 'Color': [TODAY_COLOR]})
+        self.chart_today = alt.Chart(self.ChartData('today', ['Date', 'Color'])
                       ).mark_rule(strokeWidth = 2, strokeDash=[5, 3]).encode(
-                            x = alt.X('Date:T', scale = alt.Scale(domain = [RANGE_START, RANGE_END])),
+                            x = alt.X('Date:T', scale = alt.Scale(domain = self.RangeDomain())),
                             color = alt.Color('Color:N', scale = None)
                             ).properties(width = GRAPH_WIDTH)
 
+    @Instrumented
     def PlotChartHeader(self):
         self.PlotMonthQuarterBlock()
         self.PlotQuarterText()
         self.PlotMonthText()
         self.PlotChartToday()
 
+    @Instrumented
     def PlotProgramPhase(self):
-        legend_domain = []
-        legend_range = []
-        for p in self.ps.phases:
-            legend_domain.append(p['Description'])
-            legend_range.append(p['BGColor'])
+        legend_domain, legend_range = self.PhaseLegend()
 
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_range_list)).mark_bar(
+            alt.Chart(self.ChartData('phase', ['Start', 'End', 'Index', 'Type'])).mark_bar(
                     opacity = GRAPH_BAR_OPACITY,
                     size = GRAPH_BAR_HEIGHT,
                     cornerRadius = 5
                 ).encode(
-                x = alt.X('Start',
-                        scale = alt.Scale(domain = [RANGE_START, RANGE_END]),
+                x = alt.X('Start:T',
+                        scale = alt.Scale(domain = self.RangeDomain()),
                         axis = alt.Axis(title = '',
                                         labelAngle=0,
                                         format = ('%m'),
@@ -203,12 +460,13 @@ class ProgramChart():
                                   scale = alt.Scale(domain = legend_domain, range = legend_range),
                                   legend = alt.Legend(orient = 'right')
                                   ),
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotProgramName(self):
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_name_list)).mark_text(dx = -5, align = 'right').encode(
+            alt.Chart(self.ChartData('program', ['Index', 'FGColor', 'Program'])).mark_text(dx = -5, align = 'right').encode(
                 x = alt.value(0),
                 y = alt.Y('Index:N',
                         axis = alt.Axis(title = None, ticks = False, labels = False),
@@ -216,32 +474,30 @@ class ProgramChart():
                         ),
                 color = alt.Color('FGColor:N', scale = None, legend = None),
                 text = 'Program:N'
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotProgramPhaseDescription(self):
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_range_list)).mark_text(dx = 5, align = 'left').encode(
-                x = alt.X('Start', scale = alt.Scale(domain=[RANGE_START, RANGE_END])),
+            alt.Chart(self.ChartData('phase', ['Start', 'Index', 'FGColor', 'Description'])).mark_text(dx = 5, align = 'left').encode(
+                x = alt.X('Start:T', scale = alt.Scale(domain = self.RangeDomain())),
                 y = alt.Y('Index:N',
                         axis = alt.Axis(title = None, ticks = False, labels = False),
                         sort = alt.EncodingSortField(field = 'Index', order = 'ascending'),
                         ),
                 color = alt.Color('FGColor:N', scale = None, legend = None),
                 text = 'Description:N'
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotProgramEvent(self):
-        legend_domain = []
-        legend_range = []
-        for e in self.ps.events:
-            legend_domain.append(e['Description'])
-            legend_range.append(e['BGColor'])
+        legend_domain, legend_range = self.EventLegend()
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_event_list)).mark_point(filled = True, size = 100, yOffset = 10).encode(
-                x = alt.X('Date',
-                          scale = alt.Scale(domain=[RANGE_START, RANGE_END])),
+            alt.Chart(self.ChartData('event', ['Date', 'Index', 'Type'])).mark_point(filled = True, size = 100, yOffset = 10).encode(
+                x = alt.X('Date:T',
+                          scale = alt.Scale(domain = self.RangeDomain())),
                 y = alt.Y('Index:O',
                           axis = alt.Axis(title = None, ticks = False, labels = False),
                           sort = alt.EncodingSortField(field = 'Index', order = 'ascending'),
@@ -254,35 +510,38 @@ class ProgramChart():
                                   scale = alt.Scale(domain = legend_domain, range = legend_range),
                                   legend = alt.Legend(orient = 'right')
                                   ),
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotProgramEventDescription(self):
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_event_list)).mark_text(dx = EVENT_DESC_OFFSET_X, dy = EVENT_DESC_OFFSET_Y, align = 'left').encode(
-                x = alt.X('Date', scale = alt.Scale(domain = [RANGE_START, RANGE_END])),
+            alt.Chart(self.ChartData('event', ['Date', 'Index', 'FGColor', 'Description'])).mark_text(dx = EVENT_DESC_OFFSET_X, dy = EVENT_DESC_OFFSET_Y, align = 'left').encode(
+                x = alt.X('Date:T', scale = alt.Scale(domain = self.RangeDomain())),
                 y = alt.Y('Index:N',
                         axis = alt.Axis(title = None, ticks = False, labels = False),
                         sort = alt.EncodingSortField(field = 'Index', order = 'ascending'),
                         ),
                 color = alt.Color('FGColor:N', scale = None, legend = None),
-                text = 'Description'
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+                text = 'Description:N'
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotProgramEventDate(self):
         self.chart_program.append(
-            alt.Chart(pd.DataFrame(self.ps.program_bar_event_list)).mark_text(dx = EVENT_DATE_DESC_OFFSET_X, dy = EVENT_DATE_DESC_OFFSET_Y, align = 'left').encode(
-                x = alt.X('Date', scale = alt.Scale(domain=[RANGE_START, RANGE_END])),
+            alt.Chart(self.ChartData('event', ['Date', 'Index', 'FGColor', 'Date_Short'])).mark_text(dx = EVENT_DATE_DESC_OFFSET_X, dy = EVENT_DATE_DESC_OFFSET_Y, align = 'left').encode(
+                x = alt.X('Date:T', scale = alt.Scale(domain = self.RangeDomain())),
                 y = alt.Y('Index:N',
                         axis = alt.Axis(title = None, ticks = False, labels = False),
                         sort = alt.EncodingSortField(field = 'Index', order = 'ascending'),
                         ),
                 color = alt.Color('FGColor:N', scale = None, legend = None),
-                text = 'Date_Short'
-            ).properties(width = GRAPH_WIDTH, height = (GRAPH_BAR_SPACE * len(self.ps.schedule_data['Data'])))
+                text = 'Date_Short:N'
+            ).properties(width = GRAPH_WIDTH, height = self.ChartHeight())
         )
 
+    @Instrumented
     def PlotChartBody(self):
         self.PlotProgramPhase()
         self.PlotProgramName()
@@ -291,9 +550,8 @@ class ProgramChart():
         self.PlotProgramEventDescription()
         self.PlotProgramEventDate()
 
-    def PlotShow(self):
-        alt.renderers.enable('altair_viewer')
-        alt.vconcat(alt.layer(
+    def BuildChart(self, datasets = True):
+        chart = alt.vconcat(alt.layer(
                         self.chart_header[0],
                         self.chart_header[1],
                         self.chart_header[2],
@@ -312,129 +570,1630 @@ class ProgramChart():
                             shape = 'independent'
                         )
             ).configure(
-                background = CHART_COLOR_BG
+                background = self.context.chart_color_bg
             ).configure_concat(
                 spacing = 0
-            ).show()
+            )
+        if (datasets):
+            chart = chart.properties(datasets = self.ChartDatasets())
+        return chart
+
+    @Instrumented
+    def BuildSpec(self, precompiled = False):
+        # Validating and converting thousands of records through Altair is slow, so the
+        # layout is converted alone and the datasets are attached to the plain dict.
+        # Precompiled skips Altair entirely and fills in the cached layout for this context.
+        if (precompiled):
+            return GetSpecTemplate(self.context, self.prune_columns).Render(self)
+        spec = self.BuildChart(datasets = False).to_dict()
+        spec['datasets'] = self.ChartDatasets()
+        return spec
+
+    @Instrumented
+    def PlotShow(self):
+        alt.renderers.enable('altair_viewer')
+        self.BuildChart().show()
+
+    @Instrumented
+    def PlotSave(self, output, fmt = None, renderer = None, precompiled = False):
+        # Render offline to a path or a writable binary buffer, format from extension by default
+        fmt = OutputFormat(output, fmt)
+        if (renderer is None):
+            renderer = ChartRenderer()
+        data = renderer.Render(self.BuildSpec(precompiled), fmt)
+        if (hasattr(output, 'write')):
+            output.write(data)
+        else:
+            with open(output, 'wb') as f:
+                f.write(data)
+        return data
+
+class HeaderBand():
+    """Header rows for one window, bands and header colors, with their dataset records.
+
+    Built from pd.date_range in one pass per band: Index 0 is the upper band
+    (quarter colors), Index 1 the lower band, alternating month_color_bg by
+    position in the range. Bars run from Start to End, text sits at Middle.
+    """
+
+    def __init__(self, context):
+        rows = []
+        range_start = pd.Timestamp(context.range_start)
+        range_end = pd.Timestamp(context.range_end)
+        for index, unit in enumerate(context.bands):
+            period = BandStarts(range_start, range_end, unit)
+            if (unit == 'W'):
+                end = period + pd.Timedelta(days = 6)
+            else:
+                end = period + pd.DateOffset(months = BAND_MONTHS[unit]) - pd.Timedelta(days = 1)
+            # Periods overlapping a window edge are cut at the edge
+            start = period.where(period > range_start, range_start)
+            end = end.where(end < range_end, range_end)
+            if (index == 0):
+                bg_color = np.full(len(start), context.quarter_color_bg, dtype = object)
+                fg_color = context.quarter_color_fg
+            else:
+                colors = np.array(context.month_color_bg, dtype = object)
+                bg_color = colors[np.arange(len(start)) % len(colors)]
+                fg_color = context.month_color_fg
+            rows.append(pd.DataFrame({'Program': BAND_NAMES[unit],
+                                      'Index': index,
+                                      'Start': start,
+                                      'End': end,
+                                      'Middle': start + (end - start) / 2,
+                                      'BGColor': bg_color,
+                                      'FGColor': fg_color,
+                                      'Description': BandLabels(period, unit)}))
+        self.table = pd.concat(rows, ignore_index = True)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def Values(self, columns):
+        # Dataset records for a column subset, converted once
+        with self.lock:
+            if (columns not in self.values):
+                self.values[columns] = DatasetValues(self.table[list(columns)])
+            return self.values[columns]
+
+def BandStarts(range_start, range_end, unit):
+    # Start of every period overlapping the range
+    first = PeriodStart(range_start, unit)
+    if (unit == 'W'):
+        return pd.date_range(first, range_end, freq = 'W-MON')
+    start = pd.date_range(first, range_end, freq = 'MS')
+    return start[(start.month - 1) % BAND_MONTHS[unit] == 0]
+
+def BandLabels(start, unit):
+    year = start.year.astype(str)
+    if (unit == 'Y'):
+        return year
+    if (unit == 'H'):
+        return year + 'H' + ((start.month - 1) // 6 + 1).astype(str)
+    if (unit == 'Q'):
+        return year + 'Q' + start.quarter.astype(str)
+    if (unit == 'M'):
+        return start.strftime('%m')
+    return start.strftime('W%V')
+
+# Most recently used header bands, the window changes at most daily so few are live
+header_bands = collections.OrderedDict()
+header_bands_lock = threading.Lock()
+HEADER_BANDS_MAX = 64
+
+def GetHeaderBand(context):
+    key = (context.range_start, context.range_end, context.bands, context.quarter_color_bg, context.quarter_color_fg,
+           context.month_color_bg, context.month_color_fg)
+    with header_bands_lock:
+        if (key in header_bands):
+            header_bands.move_to_end(key)
+            return header_bands[key]
+    band = HeaderBand(context)
+    with header_bands_lock:
+        header_bands[key] = band
+        while (len(header_bands) > HEADER_BANDS_MAX):
+            header_bands.popitem(last = False)
+    return band
+
+class ChartRenderer():
+    """Offline Vega-Lite to SVG/PNG/HTML converter built on vl-convert.
+
+    vl-convert keeps its JavaScript runtime alive between calls, so one
+    renderer should be reused for a batch of charts.
+    """
+    FORMATS = ('svg', 'png', 'html')
+
+    def __init__(self, scale = 1):
+        try:
+            import vl_convert
+        except ImportError as err:
+            raise ImportError('Headless rendering requires vl-convert-python') from err
+        self.vlc = vl_convert
+        self.scale = scale
+        version = '.'.join(LoadAltair().SCHEMA_VERSION.lstrip('v').split('.')[:2])
+        self.vl_version = version if (version in vl_convert.get_vegalite_versions()) else None
+
+    def Warm(self):
+        # First conversion pays the JavaScript runtime startup, do it ahead of real work
+        self.Render({'mark': 'point', 'data': {'values': [{}]}}, 'svg')
+
+    @Instrumented
+    def Render(self, spec, fmt):
+        if (fmt == 'svg'):
+            return self.vlc.vegalite_to_svg(spec, vl_version = self.vl_version).encode()
+        if (fmt == 'png'):
+            return self.vlc.vegalite_to_png(spec, vl_version = self.vl_version, scale = self.scale)
+        if (fmt == 'html'):
+            return self.vlc.vegalite_to_html(spec, vl_version = self.vl_version, bundle = True).encode()
+        raise ValueError('Unsupported output format %s, expect one of %s' %(fmt, ', '.join(self.FORMATS)))
+
+def OutputFormat(output, fmt):
+    # fmt if given, else taken from the extension of the output path
+    if (fmt is not None):
+        return fmt
+    if (hasattr(output, 'write')):
+        raise ValueError('Output to a buffer needs fmt, one of %s' %(', '.join(ChartRenderer.FORMATS)))
+    return os.path.splitext(output)[1].lstrip('.').lower()
+
+class TemplateChart(ProgramChart):
+    # Placeholders for the per schedule values of the layout, see SpecTemplate
+    PLACEHOLDERS = {'title': '__TITLE__',
+                    'range': ['__RANGE_START__', '__RANGE_END__'],
+                    'height': 987654321,
+                    'phase_domain': ['__PHASE_DOMAIN__'],
+                    'phase_range': ['__PHASE_RANGE__'],
+                    'event_domain': ['__EVENT_DOMAIN__'],
+                    'event_range': ['__EVENT_RANGE__']}
+
+    def ChartTitle(self):
+        return self.PLACEHOLDERS['title']
+
+    def RangeDomain(self):
+        return self.PLACEHOLDERS['range']
+
+    def ChartHeight(self):
+        return self.PLACEHOLDERS['height']
+
+    def PhaseLegend(self):
+        return self.PLACEHOLDERS['phase_domain'], self.PLACEHOLDERS['phase_range']
+
+    def EventLegend(self):
+        return self.PLACEHOLDERS['event_domain'], self.PLACEHOLDERS['event_range']
+
+class SpecTemplate():
+    """Compiled Vega-Lite layout for one context, reused for every chart drawn with it.
+
+    The layout is built and validated through Altair once, with placeholders
+    for title, range domain, height and legends. Render() parses the cached
+    JSON, fills those slots and attaches the datasets, without Altair or
+    schema validation.
+    """
+
+    def __init__(self, context, prune_columns = True):
+        chart = TemplateChart(ProgramSchedule('Template', context), context, prune_columns)
+        chart.PlotChartHeader()
+        chart.PlotChartBody()
+        spec = chart.BuildChart(datasets = False).to_dict()
+        self.data_columns = chart.data_columns
+        self.slots = []
+        self.FindSlots(spec, ())
+        self.layout = json.dumps(spec)
+
+    def FindSlots(self, node, path):
+        items = node.items() if isinstance(node, dict) else enumerate(node)
+        for key, value in items:
+            for slot, placeholder in TemplateChart.PLACEHOLDERS.items():
+                if (value == placeholder):
+                    self.slots.append((path + (key,), slot))
+                    break
+            else:
+                if (isinstance(value, (dict, list))):
+                    self.FindSlots(value, path + (key,))
+
+    def Render(self, pc, datasets = None):
+        spec = json.loads(self.layout)
+        self.FillSlots(spec, pc)
+        spec['datasets'] = datasets if (datasets is not None) else pc.ChartDatasets(self.data_columns)
+        return spec
+
+    def FillSlots(self, spec, pc):
+        # Also used to update a spec rendered earlier from this template in place
+        phase_domain, phase_range = pc.PhaseLegend()
+        event_domain, event_range = pc.EventLegend()
+        values = {'title': pc.ChartTitle(),
+                  'range': pc.RangeDomain(),
+                  'height': pc.ChartHeight(),
+                  'phase_domain': phase_domain,
+                  'phase_range': phase_range,
+                  'event_domain': event_domain,
+                  'event_range': event_range}
+        for path, slot in self.slots:
+            node = spec
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = values[slot]
+
+# Compiled layouts, one per distinct layout settings
+spec_templates = {}
+spec_templates_lock = threading.Lock()
+
+def GetSpecTemplate(context, prune_columns = True):
+    key = (GRAPH_WIDTH, GRAPH_BAR_HEIGHT, GRAPH_BAR_SPACE, GRAPH_BAR_OPACITY,
+           EVENT_DESC_OFFSET_X, EVENT_DESC_OFFSET_Y, EVENT_DATE_DESC_OFFSET_X, EVENT_DATE_DESC_OFFSET_Y,
+           context.chart_color_bg, context.quarter_color_fg, context.month_color_fg, prune_columns)
+    with spec_templates_lock:
+        if (key not in spec_templates):
+            spec_templates[key] = SpecTemplate(context, prune_columns)
+        return spec_templates[key]
 
 class ProgramSchedule():
-    schedule_data = json.dumps({'key': 1})
-    description = 'Program Details'
-    phases = []
-    events = []
-    program_bar_name_list = []
-    program_bar_range_list = []
-    program_bar_event_list = []
-
-    def __init__(self, name):
+    # Processed tables, all keyed by program Index
+    TABLES = ('program_bar_name_table', 'program_bar_range_table', 'program_bar_event_table', 'program_bar_span_table')
+
+    def __init__(self, name, context = None):
         self.name = name
+        self.context = context or RenderContext()
+        self.schedule_data = {}
+        self.description = 'Program Details'
+        self.phases = []
+        self.events = []
+        self.program_bar_name_table = None
+        self.program_bar_range_table = None
+        self.program_bar_event_table = None
+        self.program_bar_span_table = None
+        self.program_columns = None
+        self.interval_index = None
+
+    @Instrumented
+    def ParseDataFromJSON(self, file, stream = False):
+        # Files written by ConvertSchedule are recognized and loaded as is
+        if (BinarySchedule.IsBinary(file)):
+            self.ParseDataFromBinary(file)
+            return
+        if (stream):
+            self.ParseDataFromJSONStream(file)
+            return
 
-    def ParseDataFromJSON(self, file):
         with open(file) as f:
             try:
-                self.schedule_data = json.load(f)
-                if 'Data' not in self.schedule_data:
-                    print('JSON %s doesn\'t have valid data for schedule and event' %(file))
-                    exit()
-                if 'Phase_List' not in self.schedule_data:
-                    print('JSON %s doesn\'t have valid Phase definition' %(file))
-                    exit()
-                if 'Event_List' not in self.schedule_data:
-                    print('JSON %s doesn\'t have valid Event definition' %(file))
-                    exit()
-                if 'Description' in self.schedule_data:
-                    self.description = self.schedule_data['Description']
+                schedule_data = json.load(f)
             except ValueError as err:
-                print('Invalid JSON for %s' %(file))
-                exit()
+                raise ScheduleError('Invalid JSON for %s' %(file)) from err
+        self.ParseData(schedule_data, file)
 
         print(self.description, 'Loaded from JSON')
 
+    def ParseData(self, schedule_data, file = 'data'):
+        # Schedule already decoded from JSON, e.g. received by RenderService
+        if ((not isinstance(schedule_data, dict)) or ('Data' not in schedule_data)):
+            raise ScheduleError('JSON %s doesn\'t have valid data for schedule and event' %(file))
+        if 'Phase_List' not in schedule_data:
+            raise ScheduleError('JSON %s doesn\'t have valid Phase definition' %(file))
+        if 'Event_List' not in schedule_data:
+            raise ScheduleError('JSON %s doesn\'t have valid Event definition' %(file))
+        self.schedule_data = schedule_data
+        if 'Description' in schedule_data:
+            self.description = schedule_data['Description']
+
+    def ParseDataFromJSONStream(self, file):
+        # Incremental parse: every top-level member except Data is kept as is, while each Data
+        # entry is built one program at a time and flattened into ProgramColumns right away, so
+        # the full document tree is never materialized.
+        if (ijson is None):
+            raise ImportError('Streaming JSON loader requires ijson')
+
+        header = {}
+        columns = ProgramColumns()
+        has_data = False
+        builder = None
+        with open(file, 'rb') as f:
+            try:
+                for prefix, event, value in ijson.parse(f, use_float = True):
+                    if (builder is not None):
+                        builder.event(event, value)
+                        if ((prefix == builder_prefix) and (event in ('end_map', 'end_array'))):
+                            if (builder_prefix == 'Data.item'):
+                                columns.Append(builder.value)
+                            else:
+                                header[builder_prefix] = builder.value
+                            builder = None
+                    elif (prefix == 'Data'):
+                        has_data = has_data or (event == 'start_array')
+                    elif ((prefix == 'Data.item') or ('.' not in prefix and prefix != '')):
+                        if (event in ('start_map', 'start_array')):
+                            builder = ijson.ObjectBuilder()
+                            builder_prefix = prefix
+                            builder.event(event, value)
+                        elif (event != 'map_key'):
+                            header[prefix] = value
+            except ijson.JSONError as err:
+                raise ScheduleError('Invalid JSON for %s' %(file)) from err
+
+        if (not has_data):
+            raise ScheduleError('JSON %s doesn\'t have valid data for schedule and event' %(file))
+        if 'Phase_List' not in header:
+            raise ScheduleError('JSON %s doesn\'t have valid Phase definition' %(file))
+        if 'Event_List' not in header:
+            raise ScheduleError('JSON %s doesn\'t have valid Event definition' %(file))
+        if 'Description' in header:
+            self.description = header['Description']
+        self.schedule_data = header
+        self.program_columns = columns
+
+        print(self.description, 'Loaded from JSON')
+
+    def ParseDataFromBinary(self, file):
+        header, columns = BinarySchedule.Read(file)
+        if 'Description' in header:
+            self.description = header['Description']
+        self.schedule_data = header
+        self.program_columns = columns
+
+        print(self.description, 'Loaded from binary')
+
+    @Instrumented
     def PreparePhaseList(self):
         self.phases = []
         for phase_def in self.schedule_data['Phase_List']:
             self.phases.append({'Type': phase_def['Type'], 'Description': phase_def['Description'], 'BGColor': phase_def['BGColor'], 'FGColor': phase_def['FGColor']})
 
+    @Instrumented
     def PrepareEventList(self):
         self.events = []
         for event_def in self.schedule_data['Event_List']:
             self.events.append({'Type': event_def['Type'], 'Description': event_def['Description'], 'BGColor': event_def['BGColor'], 'FGColor': event_def['FGColor']})
 
+    @Instrumented
     def ProcessProgramDetails(self):
-        self.program_bar_name_list = []
-        self.program_bar_range_list = []
-        self.program_bar_event_list = []
-
-        for program_data in self.schedule_data['Data']:
-            # Prepare all program name to be shown on y-axis
-            self.program_bar_name_list.append({'Program': program_data['Program'], 'Index': program_data['Index'], 'FGColor': CHART_COLOR_FG})
-
-            # Prepare phase bar
-            if 'Phase' in program_data:
-                for program_phase in program_data['Phase']:
-                    # Decide current phase type
-                    unsupported = True
-                    for p in self.phases:
-                        if (p['Type'] == program_phase['Type']):
-                            unsupported = False
-                            break
-                    if (unsupported):
-                        print('Unsupported Phase type %d for %s' %(program_phase['Type'], program_data['Program']))
-                        exit()
-
-                    entry = {'Program': program_data['Program'],
-                             'Index': program_data['Index'],
-                             'Type': p['Description'], # Use description as Type for legend label
-                             'Start': ((pd.to_datetime(RANGE_START)) if (pd.to_datetime(program_phase['Start']) < pd.to_datetime(RANGE_START)) else (pd.to_datetime(program_phase['Start']))) if (program_phase['Start'] != '') else (pd.to_datetime(RANGE_START)),
-                             'End' : ((pd.to_datetime(RANGE_END)) if (pd.to_datetime(program_phase['End']) > pd.to_datetime(RANGE_END)) else (pd.to_datetime(program_phase['End']))) if (program_phase['End'] != '') else (pd.to_datetime(RANGE_END)),
-                             'BGColor': p['BGColor'],
-                             'FGColor': p['FGColor'],
-                             'Description': ''
-                            }
-                    if (('End_Today' in program_phase) and program_phase['End_Today']):
-                        entry['End'] = pd.to_datetime(pd.Timestamp.today().strftime('%Y-%m-%d'))
-
-                    # Hide phase description
-                    if (not program_phase['Hide_Description']):
-                        entry['Description'] = (p['Description'] + str(program_phase['Additional Info'])) if ('Additional Info' in program_phase) else (p['Description'])
-                    self.program_bar_range_list.append(entry)
-
-            # Prepare event marker
-            if 'Event' in program_data:
-                for program_event in program_data['Event']:
-                    # Decide current event type
-                    unsupported = True
-                    for e in self.events:
-                        if (e['Type'] == program_event['Type']):
-                            unsupported = False
-                            break
-                    if (unsupported):
-                        print('Unsupported Event type %d for %s' %(program_event['Type'], program_data['Program']))
-                        exit()
-
-                    entry = {'Program': program_data['Program'],
-                             'Index': program_data['Index'],
-                             'Type': e['Description'], # Use description as Type for legend label
-                             'Date': pd.to_datetime(program_event['Date']),
-                             'BGColor': e['BGColor'],
-                             'FGColor': e['FGColor'],
-                             'Description': (e['Description'] + str(program_event['Additional Info'])) if ('Additional Info' in program_event) else (e['Description']),
-                             'Date_Short': str(pd.to_datetime(program_event['Date']).strftime('%m/%d') + ((str(program_event['Additional Date Info'])) if ('Additional Date Info' in program_event) else ('')))
-                            }
-                    self.program_bar_event_list.append(entry)
-
-def PlotGantt(name, json_file):
-    ps = ProgramSchedule(name)
-    if (os.path.isfile(json_file)):
-        ps.ParseDataFromJSON(json_file)
+        # Streaming loader has already flattened Data while parsing
+        columns = self.program_columns
+        if (columns is None):
+            columns = ProgramColumns()
+            for program_data in self.schedule_data['Data']:
+                columns.Append(program_data)
+        self.BuildProgramTables(columns)
+
+    def BuildProgramTables(self, columns):
+        range_start = pd.to_datetime(self.context.range_start)
+        range_end = pd.to_datetime(self.context.range_end)
+        today = pd.to_datetime(self.context.today)
+        program = np.asarray(columns.program, dtype = object)
+        index = np.asarray(columns.index)
+
+        # Prepare all program name to be shown on y-axis
+        self.program_bar_name_table = pd.DataFrame({'Program': program, 'Index': index, 'FGColor': self.context.chart_color_fg})
+
+        phase_start, phase_end, event_date = columns.Dates()
+
+        # Prepare phase bar
+        phase_row = np.asarray(columns.phase_row, dtype = np.intp)
+        phase_type = ResolveType(self.phases, columns.phase_type, program[phase_row], 'Phase')
+        start = np.where(np.isnat(phase_start) | (phase_start < range_start), range_start.to_datetime64(), phase_start)
+        end = np.where(np.isnat(phase_end) | (phase_end > range_end), range_end.to_datetime64(), phase_end)
+        end_today = np.asarray(columns.phase_end_today, dtype = bool)
+        end = np.where(end_today, today.to_datetime64(), end)
+        phase_end = np.where(end_today, today.to_datetime64(), phase_end)
+        # Hide phase description
+        description = phase_type['Description'] + pd.Series(columns.phase_info, dtype = object).values
+        description[np.asarray(columns.phase_hide, dtype = bool)] = ''
+        self.program_bar_range_table = pd.DataFrame({'Program': program[phase_row],
+                                                     'Index': index[phase_row],
+                                                     'Type': phase_type['Description'], # Use description as Type for legend label
+                                                     'Start': pd.to_datetime(start),
+                                                     'End': pd.to_datetime(end),
+                                                     'BGColor': phase_type['BGColor'],
+                                                     'FGColor': phase_type['FGColor'],
+                                                     'Description': description
+                                                     })
+
+        # Prepare event marker
+        event_row = np.asarray(columns.event_row, dtype = np.intp)
+        event_type = ResolveType(self.events, columns.event_type, program[event_row], 'Event')
+        event_date = pd.Series(event_date)
+        self.program_bar_event_table = pd.DataFrame({'Program': program[event_row],
+                                                     'Index': index[event_row],
+                                                     'Type': event_type['Description'], # Use description as Type for legend label
+                                                     'Date': event_date,
+                                                     'BGColor': event_type['BGColor'],
+                                                     'FGColor': event_type['FGColor'],
+                                                     'Description': event_type['Description'] + pd.Series(columns.event_info, dtype = object).values,
+                                                     'Date_Short': (ShortDates(event_date.values) + pd.Series(columns.event_date_info, dtype = object)).values
+                                                     })
+
+        # Unclipped phase dates for queries, empty Start/End (NaT) is open ended
+        self.program_bar_span_table = pd.DataFrame({'Index': index[phase_row],
+                                                    'Start': pd.to_datetime(phase_start),
+                                                    'End': pd.to_datetime(phase_end)})
+        self.interval_index = None
+
+    def IntervalIndex(self):
+        # Built on first query: one index over phase spans, one over event dates
+        if (self.interval_index is None):
+            span = self.program_bar_span_table
+            dates = DateKeys(self.program_bar_event_table['Date'])
+            self.interval_index = (ScheduleIndex(DateKeys(span['Start'], OPEN_START), DateKeys(span['End'], OPEN_END)),
+                                   ScheduleIndex(dates, dates))
+        return self.interval_index
+
+    def QueryWindow(self, start, end):
+        # Phases overlapping and events falling in [start, end], as rows of the phase/event tables
+        phase_index, event_index = self.IntervalIndex()
+        start, end = DateKey(start), DateKey(end)
+        return (self.program_bar_range_table.iloc[phase_index.QueryWindow(start, end)],
+                self.program_bar_event_table.iloc[event_index.QueryWindow(start, end)])
+
+    def ActiveOn(self, date):
+        phase_index, event_index = self.IntervalIndex()
+        date = DateKey(date)
+        return (self.program_bar_range_table.iloc[phase_index.Stab(date)],
+                self.program_bar_event_table.iloc[event_index.Stab(date)])
+
+    def Overlaps(self, program):
+        # Phases of other programs overlapping any phase of program (its Index or name)
+        phase_index, _ = self.IntervalIndex()
+        span = self.program_bar_span_table
+        names = self.program_bar_name_table
+        index = names['Index'][names['Program'] == program].tolist() if (isinstance(program, str)) else program
+        own = np.flatnonzero(span['Index'].isin(np.atleast_1d(index)).values)
+        rows = [phase_index.QueryWindow(phase_index.starts[row], phase_index.ends[row]) for row in own]
+        rows = np.unique(np.concatenate(rows)) if (rows) else np.array([], dtype = np.intp)
+        rows = rows[~np.isin(rows, own)]
+        return self.program_bar_range_table.iloc[rows]
+
+    def WindowIndices(self):
+        # Programs with any phase or event inside the range
+        phase, event = self.QueryWindow(self.context.range_start, self.context.range_end)
+        visible = pd.concat([phase['Index'], event['Index']])
+        names = self.program_bar_name_table
+        return names['Index'][names['Index'].isin(visible)].tolist()
+
+    def SelectPrograms(self, indices, description = None):
+        # New schedule sharing definitions and context, with only the given program Index values
+        selected = ProgramSchedule(self.name, self.context)
+        selected.schedule_data = self.schedule_data
+        selected.description = description or self.description
+        selected.phases = self.phases
+        selected.events = self.events
+        for table in ProgramSchedule.TABLES:
+            df = getattr(self, table)
+            setattr(selected, table, df[df['Index'].isin(indices)].reset_index(drop = True))
+        return selected
+
+    def FilterToWindow(self):
+        return self.SelectPrograms(self.WindowIndices())
+
+    def Paginate(self, page_size = None, window_only = False):
+        # Split by Index order into pages of at most page_size programs
+        indices = self.WindowIndices() if (window_only) else self.program_bar_name_table['Index'].tolist()
+        indices = sorted(indices)
+        page_size = page_size or max(1, len(indices))
+        chunks = [indices[i:i + page_size] for i in range(0, len(indices), page_size)] or [[]]
+        if (len(chunks) == 1):
+            return [self.SelectPrograms(chunks[0])]
+        return [self.SelectPrograms(chunk, '%s (%d/%d)' %(self.description, number + 1, len(chunks)))
+                for number, chunk in enumerate(chunks)]
+
+    @property
+    def program_bar_name_list(self):
+        return self.program_bar_name_table.to_dict('records')
+
+    @property
+    def program_bar_range_list(self):
+        return self.program_bar_range_table.to_dict('records')
+
+    @property
+    def program_bar_event_list(self):
+        return self.program_bar_event_table.to_dict('records')
+
+class ProgramColumns():
+    """Flattened program/phase/event columns, one list entry per row.
+
+    Phase and event rows refer back to their program by position (row) in
+    the program columns. Dates are kept as raw strings until BuildProgramTables
+    parses them in one batch.
+    """
+
+    def __init__(self):
+        self.program = []
+        self.index = []
+        self.phase_row = []
+        self.phase_type = []
+        self.phase_start = []
+        self.phase_end = []
+        self.phase_end_today = []
+        self.phase_hide = []
+        self.phase_info = []
+        self.event_row = []
+        self.event_type = []
+        self.event_date = []
+        self.event_info = []
+        self.event_date_info = []
+
+    def Append(self, program_data):
+        row = len(self.program)
+        self.program.append(program_data['Program'])
+        self.index.append(program_data['Index'])
+
+        for program_phase in program_data.get('Phase', ()):
+            self.phase_row.append(row)
+            self.phase_type.append(program_phase['Type'])
+            self.phase_start.append(program_phase['Start'])
+            self.phase_end.append(program_phase['End'])
+            self.phase_end_today.append(bool(program_phase.get('End_Today', False)))
+            self.phase_hide.append(bool(program_phase['Hide_Description']))
+            self.phase_info.append(str(program_phase['Additional Info']) if ('Additional Info' in program_phase) else '')
+
+        for program_event in program_data.get('Event', ()):
+            self.event_row.append(row)
+            self.event_type.append(program_event['Type'])
+            self.event_date.append(program_event['Date'])
+            self.event_info.append(str(program_event['Additional Info']) if ('Additional Info' in program_event) else '')
+            self.event_date_info.append(str(program_event['Additional Date Info']) if ('Additional Date Info' in program_event) else '')
+
+    def Dates(self):
+        # All phase and event dates are parsed in one batch, empty string becomes NaT
+        phase_count = len(self.phase_start)
+        dates = ParseDates(self.phase_start + self.phase_end + self.event_date)
+        return dates[:phase_count], dates[phase_count:2 * phase_count], dates[2 * phase_count:]
+
+class BinaryColumns(ProgramColumns):
+    """ProgramColumns backed by numpy arrays from a BinarySchedule file.
+
+    Dates are day numbers and are converted, not parsed.
+    """
+
+    def Append(self, program_data):
+        raise TypeError('BinaryColumns is read only')
+
+    def Dates(self):
+        return tuple(BinarySchedule.DaysToDates(days) for days in (self.phase_start, self.phase_end, self.event_date))
+
+class BinarySchedule():
+    """Compact columnar schedule file, loaded by memory mapping.
+
+    The file is MAGIC, a little endian uint32 header length, a JSON header and
+    the column arrays, each aligned to 8 bytes. The header keeps every top-level
+    member of the schedule JSON except Data, plus the dtype, offset and count of
+    each column. Dates are int32 days since 1970-01-01 (MISSING_DATE when empty),
+    Types int16 and flags uint8. Program names are a NUL separated string table
+    in program order, and the optional info strings are int32 codes into a
+    second table of distinct values.
+    """
+    MAGIC = b'PGANTTB1'
+    MISSING_DATE = np.iinfo(np.int32).min
+    STRINGS = ('phase_info', 'event_info', 'event_date_info')
+
+    @staticmethod
+    def IsBinary(file):
+        with open(file, 'rb') as f:
+            return (f.read(len(BinarySchedule.MAGIC)) == BinarySchedule.MAGIC)
+
+    @staticmethod
+    def DatesToDays(values, file):
+        dates = ParseDates(values)
+        days = dates.astype('datetime64[D]')
+        if (((days != dates) & ~np.isnat(dates)).any()):
+            raise ScheduleError('Binary schedule for %s only stores whole days' %(file))
+        days = days.astype(np.int64)
+        days[np.isnat(dates)] = BinarySchedule.MISSING_DATE
+        return days.astype(np.int32)
+
+    @staticmethod
+    def DaysToDates(days):
+        dates = days.astype('datetime64[D]').astype('datetime64[us]')
+        dates[days == BinarySchedule.MISSING_DATE] = np.datetime64('NaT')
+        return dates
+
+    @staticmethod
+    def StringTable(strings, file):
+        if (any('\0' in s for s in strings)):
+            raise ScheduleError('Binary schedule for %s can\'t store a NUL character' %(file))
+        return np.frombuffer('\0'.join(strings).encode('utf-8'), dtype = np.uint8)
+
+    @staticmethod
+    def Write(file, header, columns):
+        # header: schedule members other than Data, columns: ProgramColumns of Data
+        phase_type = np.asarray(columns.phase_type)
+        event_type = np.asarray(columns.event_type)
+        index = np.asarray(columns.index)
+        for name, values in (('Index', index), ('Phase Type', phase_type), ('Event Type', event_type)):
+            if (len(values) and (values.dtype.kind not in 'iu')):
+                raise ScheduleError('Binary schedule for %s needs integer %s' %(file, name))
+        if (((len(phase_type)) and (np.abs(phase_type).max() > np.iinfo(np.int16).max)) or
+            ((len(event_type)) and (np.abs(event_type).max() > np.iinfo(np.int16).max))):
+            raise ScheduleError('Binary schedule for %s needs Type to fit in int16' %(file))
+        if (not all(isinstance(program, str) for program in columns.program)):
+            raise ScheduleError('Binary schedule for %s needs string Program names' %(file))
+
+        arrays = {'index': index.astype(np.int64),
+                  'program': BinarySchedule.StringTable(columns.program, file),
+                  'phase_row': np.asarray(columns.phase_row, dtype = np.int32),
+                  'phase_type': phase_type.astype(np.int16),
+                  'phase_start': BinarySchedule.DatesToDays(columns.phase_start, file),
+                  'phase_end': BinarySchedule.DatesToDays(columns.phase_end, file),
+                  'phase_end_today': np.asarray(columns.phase_end_today, dtype = np.uint8),
+                  'phase_hide': np.asarray(columns.phase_hide, dtype = np.uint8),
+                  'event_row': np.asarray(columns.event_row, dtype = np.int32),
+                  'event_type': event_type.astype(np.int16),
+                  'event_date': BinarySchedule.DatesToDays(columns.event_date, file)}
+        strings = []
+        for name in BinarySchedule.STRINGS:
+            codes, uniques = pd.factorize(pd.Series(getattr(columns, name), dtype = object))
+            arrays[name] = codes.astype(np.int32) + len(strings)
+            strings.extend(uniques)
+        arrays['strings'] = BinarySchedule.StringTable(strings, file)
+
+        directory = {}
+        offset = 0
+        for name, array in arrays.items():
+            directory[name] = (array.dtype.str, offset, len(array))
+            offset += (array.nbytes + 7) & ~7
+        meta = json.dumps({'schedule': header, 'columns': directory}).encode('utf-8')
+        base = (len(BinarySchedule.MAGIC) + 4 + len(meta) + 7) & ~7
+        with open(file, 'wb') as f:
+            f.write(BinarySchedule.MAGIC)
+            f.write(np.uint32(len(meta)).astype('<u4').tobytes())
+            f.write(meta)
+            for name, array in arrays.items():
+                f.seek(base + directory[name][1])
+                f.write(array.astype(array.dtype.newbyteorder('<')).tobytes())
+            f.truncate(base + offset)
+
+    @staticmethod
+    def Read(file):
+        # Returns (schedule members other than Data, BinaryColumns). Numeric columns are
+        # views of the mapping, only the two string tables are decoded.
+        try:
+            with open(file, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            start = len(BinarySchedule.MAGIC)
+            if (buffer[:start] != BinarySchedule.MAGIC):
+                raise ScheduleError('%s is not a binary schedule' %(file))
+            length = int(np.frombuffer(buffer, dtype = '<u4', count = 1, offset = start)[0])
+            meta = json.loads(buffer[start + 4:start + 4 + length].decode('utf-8'))
+            base = (start + 4 + length + 7) & ~7
+            # A truncated file leaves columns shorter than the header says
+            arrays = {name: np.frombuffer(buffer, dtype = dtype, count = count, offset = base + offset)
+                      for name, (dtype, offset, count) in meta['columns'].items()}
+            program = arrays.pop('program').tobytes().decode('utf-8')
+            strings = np.array(arrays.pop('strings').tobytes().decode('utf-8').split('\0'), dtype = object)
+        except (ValueError, IndexError, KeyError, TypeError) as err:
+            raise ScheduleError('Invalid binary schedule %s' %(file)) from err
+
+        columns = BinaryColumns()
+        columns.program = program.split('\0') if (len(arrays['index'])) else []
+        for name, array in arrays.items():
+            setattr(columns, name, strings[array] if (name in BinarySchedule.STRINGS) else array)
+        columns.phase_end_today = columns.phase_end_today.view(bool)
+        columns.phase_hide = columns.phase_hide.view(bool)
+        return meta['schedule'], columns
+
+# Keys for open ended phase dates in ScheduleIndex
+OPEN_START = np.iinfo(np.int64).min + 1
+OPEN_END = np.iinfo(np.int64).max
+
+def DateKey(date):
+    return pd.Timestamp(date).as_unit('ns').value
+
+def DateKeys(dates, missing = OPEN_END):
+    keys = pd.to_datetime(dates).to_numpy().astype('datetime64[ns]').view(np.int64).copy()
+    keys[np.isnat(pd.to_datetime(dates).to_numpy())] = missing
+    return keys
+
+class ScheduleIndex():
+    """Static index over closed intervals [start, end] of int64 keys.
+
+    An interval overlaps [qs, qe] if it contains qs or starts in (qs, qe], so
+    a window query is a stabbing query plus a bisection of the start-sorted
+    order. Stabbing uses a centered interval tree whose nodes keep their
+    intervals sorted by start and by end; each node costs one binary search,
+    for O(log^2 n + k) in all. Queries return row numbers in ascending order.
+    An interval given with end before start covers [end, start], as its bar is drawn.
+    """
+    LEAF_SIZE = 16
+
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype = np.int64)
+        ends = np.asarray(ends, dtype = np.int64)
+        # Inverted spans would sit on both sides of every center and never split
+        self.starts = np.minimum(starts, ends)
+        self.ends = np.maximum(starts, ends)
+        self.by_start = np.argsort(self.starts, kind = 'stable')
+        self.sorted_starts = self.starts[self.by_start]
+        self.root = self.Build(np.arange(len(self.starts)))
+
+    def Build(self, rows):
+        if (len(rows) == 0):
+            return None
+        starts = self.starts[rows]
+        ends = self.ends[rows]
+        if (len(rows) <= self.LEAF_SIZE):
+            return (None, rows, starts, ends, None, None)
+
+        # Median endpoint: neither side can hold every interval, so the tree always shrinks
+        center = np.median(np.concatenate((starts, ends)))
+        left = ends < center
+        right = starts > center
+        here = rows[~(left | right)]
+        by_start = np.argsort(self.starts[here], kind = 'stable')
+        by_end = np.argsort(self.ends[here], kind = 'stable')
+        return (center,
+                (here[by_start], self.starts[here][by_start], here[by_end], self.ends[here][by_end]),
+                None, None,
+                self.Build(rows[left]), self.Build(rows[right]))
+
+    def Stab(self, point):
+        found = []
+        node = self.root
+        while (node is not None):
+            center, intervals, starts, ends, left, right = node
+            if (center is None):
+                # Leaf, small enough to scan
+                found.append(intervals[(starts <= point) & (ends >= point)])
+                break
+            start_rows, start_keys, end_rows, end_keys = intervals
+            if (point < center):
+                found.append(start_rows[:np.searchsorted(start_keys, point, 'right')])
+                node = left
+            elif (point > center):
+                found.append(end_rows[np.searchsorted(end_keys, point, 'left'):])
+                node = right
+            else:
+                found.append(start_rows)
+                break
+        return np.sort(np.concatenate(found)) if (found) else np.array([], dtype = np.intp)
+
+    def QueryWindow(self, start, end):
+        if (end < start):
+            return np.array([], dtype = np.intp)
+        later = self.by_start[np.searchsorted(self.sorted_starts, start, 'right'):np.searchsorted(self.sorted_starts, end, 'right')]
+        return np.sort(np.concatenate((self.Stab(start), later)))
+
+def DatasetValues(table):
+    # Inline data values for a Vega-Lite dataset: dates as ISO strings, missing values as null
+    columns = []
+    for column in table.columns:
+        values = table[column].to_numpy()
+        if (values.dtype.kind == 'M'):
+            missing = np.isnat(values)
+            values = values.astype('datetime64[s]').astype(str).astype(object)
+            values[missing] = None
+        else:
+            values = table[column].astype(object).where(table[column].notna(), None).to_numpy()
+        columns.append(values.tolist())
+    names = list(table.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+# 'MM/DD' for every (month, day), index (month - 1) * 31 + day - 1
+SHORT_DATES = np.array(['%02d/%02d' %(month, day) for month in range(1, 13) for day in range(1, 32)], dtype = object)
+
+def ShortDates(dates):
+    # Same as strftime('%m/%d') (NaT stays missing) without formatting each date
+    days = dates.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    month = (months - days.astype('datetime64[Y]')).astype(np.int64)
+    day = (days - months).astype(np.int64)
+    missing = np.isnat(days)
+    short = SHORT_DATES[np.where(missing, 0, month * 31 + day)]
+    return pd.Series(short, dtype = 'str').mask(missing)
+
+def ParseDates(values):
+    # One to_datetime call for the whole column, fall back to per-element format inference
+    # only if the strings don't share a single format.
+    try:
+        dates = pd.to_datetime(pd.Series(values, dtype = object))
+    except ValueError:
+        dates = pd.to_datetime(pd.Series(values, dtype = object), format = 'mixed')
+    return dates.values
+
+def ResolveType(definitions, types, programs, kind):
+    # First definition wins for duplicated Type, same as a linear scan would
+    lookup = {}
+    for d in definitions:
+        lookup.setdefault(d['Type'], d)
+
+    types = pd.Series(types, dtype = object)
+    unsupported = ~types.isin(lookup.keys()).values
+    if (unsupported.any()):
+        row = unsupported.argmax()
+        raise ScheduleError('Unsupported %s type %d for %s' %(kind, types[row], programs[row]))
+
+    resolved = {}
+    for key in ('Description', 'BGColor', 'FGColor'):
+        resolved[key] = types.map({t: d[key] for t, d in lookup.items()}).values.astype(object)
+    return resolved
+
+class ScheduleCache():
+    """On-disk LRU cache of processed schedule tables.
+
+    A schedule file is identified by its content hash; a (path, mtime, size)
+    record in index.json avoids re-hashing files that haven't changed. The
+    range window and today's date (for End_Today) are part of the entry key.
+    Entries are stored as uncompressed npz, and the least recently used ones
+    are evicted once the cache grows beyond max_bytes.
+    """
+    VERSION = 3
+
+    def __init__(self, cache_dir, max_bytes = 256 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok = True)
+
+    @Instrumented
+    def Process(self, ps, json_file, stream = False):
+        # Fill ps from cache, or parse and process json_file and cache the result
+        entry = self.EntryPath(json_file, ps.context)
+        if (self.Load(ps, entry)):
+            print(ps.description, 'Loaded from cache')
+            return True
+
+        ps.ParseDataFromJSON(json_file, stream)
         ps.PreparePhaseList()
         ps.PrepareEventList()
         ps.ProcessProgramDetails()
+        self.Store(ps, entry)
+        return False
+
+    def EntryPath(self, json_file, context):
+        key = '%s|%s|%s|%s|%s|%d' %(self.ContentHash(json_file), context.range_start, context.range_end, context.today, context.chart_color_fg, self.VERSION)
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + '.npz')
+
+    def ContentHash(self, json_file):
+        path = os.path.abspath(json_file)
+        st = os.stat(path)
+        with self.lock:
+            index = self.ReadIndex()
+            known = index.get(path)
+            if ((known is not None) and (known['mtime_ns'] == st.st_mtime_ns) and (known['size'] == st.st_size)):
+                return known['hash']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                digest.update(chunk)
+
+        with self.lock:
+            index = self.ReadIndex()
+            index[path] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'hash': digest.hexdigest()}
+            self.WriteAtomic(os.path.join(self.cache_dir, 'index.json'), json.dumps(index).encode())
+        return digest.hexdigest()
+
+    def ReadIndex(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'index.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def WriteAtomic(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir = self.cache_dir, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def Load(self, ps, entry):
+        try:
+            with np.load(entry, allow_pickle = False) as npz:
+                meta = json.loads(str(npz['meta']))
+                for table in ProgramSchedule.TABLES:
+                    columns = {}
+                    for column in meta['columns'][table]:
+                        name = table + '/' + column
+                        dtype = meta['dtypes'][table][column]
+                        if ((name + '/json') in npz):
+                            columns[column] = pd.Series(json.loads(str(npz[name + '/json'])), dtype = dtype)
+                        elif ((name + '/null') in npz):
+                            values = npz[name].astype(object)
+                            values[npz[name + '/null']] = np.nan
+                            columns[column] = pd.Series(values, dtype = dtype)
+                        else:
+                            columns[column] = npz[name]
+                    setattr(ps, table, pd.DataFrame(columns, columns = meta['columns'][table]))
+        except (OSError, KeyError, ValueError):
+            return False
+
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry)
+        ps.schedule_data = meta['schedule_data']
+        ps.description = meta['description']
+        ps.phases = meta['phases']
+        ps.events = meta['events']
+        return True
+
+    def Store(self, ps, entry):
+        arrays = {}
+        meta = {'schedule_data': {key: value for key, value in ps.schedule_data.items() if key != 'Data'},
+                'description': ps.description,
+                'phases': ps.phases,
+                'events': ps.events,
+                'columns': {},
+                'dtypes': {}}
+        for table in ProgramSchedule.TABLES:
+            df = getattr(ps, table)
+            meta['columns'][table] = list(df.columns)
+            meta['dtypes'][table] = {column: str(df[column].dtype) for column in df.columns}
+            for column in df.columns:
+                name = table + '/' + column
+                values = df[column].to_numpy()
+                if (values.dtype.kind != 'O'):
+                    arrays[name] = values
+                elif (isinstance(df[column].dtype, pd.StringDtype) or (pd.api.types.infer_dtype(values, skipna = False) == 'string')):
+                    # Strings as a fixed width array, missing values as a mask beside it
+                    null = df[column].isna().to_numpy()
+                    arrays[name] = np.where(null, '', values).astype(str)
+                    arrays[name + '/null'] = null
+                else:
+                    # Mixed values (an int Program, None) keep their types through JSON
+                    arrays[name + '/json'] = np.array(json.dumps(values.tolist()))
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        fd, tmp = tempfile.mkstemp(dir = self.cache_dir, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, entry)
+        self.Evict()
+
+    def Evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if (name.endswith('.npz')):
+                    try:
+                        st = os.stat(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if (total <= self.max_bytes):
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+                total -= size
+
+class IncrementalSchedule():
+    """Keep a processed schedule and its spec up to date across edits of one file.
+
+    Update() diffs the new Data against the previous version by (Program, Index)
+    and only runs BuildProgramTables for programs that were added or changed.
+    Rows of unchanged programs, and their already converted dataset records, are
+    kept and put back into Data order. A change outside Data (description, phase
+    or event list) or a repeated (Program, Index) rebuilds everything. Without
+    an injected context, each Update() derives a fresh one from the current
+    time, and a new range window or today also rebuilds everything.
+    """
+    # Chart dataset built from each processed table
+    DATASETS = {'program': 'program_bar_name_table', 'phase': 'program_bar_range_table', 'event': 'program_bar_event_table'}
+
+    def __init__(self, name, context = None, prune_columns = True):
+        self.name = name
+        self.fixed_context = (context is not None)
+        self.context = context or RenderContext()
+        self.prune_columns = prune_columns
+        self.template = GetSpecTemplate(self.context, prune_columns)
+        self.ps = None
+        self.chart = None
+        self.spec = None
+        self.header = None
+        self.keys = []
+        self.programs = {}
+        self.owners = {}
+
+    @Instrumented
+    def Update(self, json_file):
+        """Load json_file and patch the tables and spec, returns what changed or None."""
+        new = ProgramSchedule(self.name, self.CurrentContext())
+        new.ParseDataFromJSON(json_file)
+        if ('Data' not in new.schedule_data):
+            raise ScheduleError('Incremental update of %s needs a JSON schedule' %(json_file))
+        try:
+            return self.Apply(new)
+        except (KeyError, TypeError, ValueError) as err:
+            # A half edited file is normal while watching, report it like other bad input
+            raise ScheduleError('Invalid schedule data in %s: %s: %s' %(json_file, type(err).__name__, err)) from err
+
+    def CurrentContext(self):
+        # The stored context, or a new one once the range window or today has moved on
+        if (self.fixed_context):
+            return self.context
+        context = RenderContext()
+        if ((context.range_start, context.range_end, context.today) == (self.context.range_start, self.context.range_end, self.context.today)):
+            return self.context
+        return context
+
+    def Apply(self, new):
+        # Tables and spec are only replaced once everything for the new data has been built
+        data = new.schedule_data['Data']
+        header = {k: v for k, v in new.schedule_data.items() if (k != 'Data')}
+        keys = [(program_data['Program'], program_data['Index']) for program_data in data]
+
+        if ((self.ps is None) or (header != self.header) or (len(set(keys)) != len(keys)) or (new.context is not self.context)):
+            new.PreparePhaseList()
+            new.PrepareEventList()
+            columns = ProgramColumns()
+            for program_data in data:
+                columns.Append(program_data)
+            new.BuildProgramTables(columns)
+            template = GetSpecTemplate(new.context, self.prune_columns)
+            self.context = new.context
+            self.template = template
+            self.ps = new
+            self.chart = ProgramChart(new, self.context, self.prune_columns)
+            self.chart.PrepareChartHeader()
+            self.owners = self.RowOwners(columns, np.arange(len(keys)))
+            self.spec = self.template.Render(self.chart)
+            changes = {'full': True, 'changed': keys, 'removed': []}
+        else:
+            position = {key: number for number, key in enumerate(keys)}
+            changed = [number for number, key in enumerate(keys) if (self.programs.get(key) != data[number])]
+            removed = [key for key in self.keys if (key not in position)]
+            if ((not changed) and (keys == self.keys)):
+                return None
+            self.Patch(data, changed, np.array([position.get(key, -1) for key in self.keys], dtype = np.intp))
+            changes = {'full': False, 'changed': [keys[number] for number in changed], 'removed': removed}
+
+        self.header = header
+        self.keys = keys
+        # Parsed entries compare by value, no need to serialize them again
+        self.programs = dict(zip(keys, data))
+        return changes
+
+    def RowOwners(self, columns, positions):
+        # Position in Data of the program each table row belongs to
+        phase_row = np.asarray(columns.phase_row, dtype = np.intp)
+        event_row = np.asarray(columns.event_row, dtype = np.intp)
+        return {'program_bar_name_table': positions,
+                'program_bar_range_table': positions[phase_row],
+                'program_bar_event_table': positions[event_row],
+                'program_bar_span_table': positions[phase_row]}
+
+    def Patch(self, data, changed, moved):
+        # moved maps the old Data position of a program to its new one, -1 once removed
+        changed = np.asarray(changed, dtype = np.intp)
+        columns = ProgramColumns()
+        for number in changed:
+            columns.Append(data[number])
+        part = ProgramSchedule(self.name, self.context)
+        part.phases = self.ps.phases
+        part.events = self.ps.events
+        part.BuildProgramTables(columns)
+        part_owners = self.RowOwners(columns, changed)
+        part_values = ProgramChart(part, self.context, self.prune_columns).ChartDatasets(
+            {name: self.template.data_columns[name] for name in self.DATASETS})
+
+        is_changed = np.zeros(len(data), dtype = bool)
+        is_changed[changed] = True
+        orders = {}
+        for table in ProgramSchedule.TABLES:
+            owner = moved[self.owners[table]]
+            keep = np.flatnonzero((owner >= 0) & ~is_changed[np.maximum(owner, 0)])
+            owner = np.concatenate((owner[keep], part_owners[table]))
+            # Stable, so rows of one program stay in their original order
+            order = np.argsort(owner, kind = 'stable')
+            pieces = [df for df in (getattr(self.ps, table).iloc[keep], getattr(part, table)) if (len(df))]
+            df = pd.concat(pieces, ignore_index = True) if (pieces) else getattr(part, table)
+            setattr(self.ps, table, df.iloc[order].reset_index(drop = True))
+            self.owners[table] = owner[order]
+            orders[table] = (keep, order)
+        self.ps.interval_index = None
+
+        # Patch the dataset records the same way instead of converting whole tables again
+        for name, table in self.DATASETS.items():
+            keep, order = orders[table]
+            values = self.spec['datasets'][name]
+            values = [values[row] for row in keep] + part_values[name]
+            self.spec['datasets'][name] = [values[row] for row in order]
+        self.template.FillSlots(self.spec, self.chart)
+
+    def Render(self, output = None, fmt = None, renderer = None):
+        # The spec dict, or the chart rendered to fmt (written to output if given)
+        if ((output is None) and (fmt is None)):
+            return self.spec
+        data = (renderer or ChartRenderer()).Render(self.spec, OutputFormat(output, fmt))
+        if (hasattr(output, 'write')):
+            output.write(data)
+        elif (output is not None):
+            with open(output, 'wb') as f:
+                f.write(data)
+        return data
+
+def WatchGantt(json_file, on_render, output = None, fmt = None, context = None, interval = 0.5, debounce = 0.3, stop = None):
+    """Re-render json_file whenever it changes, until stop (a threading.Event) is set.
+
+    The file is polled every interval seconds. A change is only picked up once
+    the file has been left alone for debounce seconds, so a burst of saves
+    renders once. Each render is incremental (see IncrementalSchedule) and
+    on_render(data, changes) receives the spec dict, or the rendered bytes when
+    output or fmt is given, and what Update() reported as changed. Without a
+    context, the chart is also rendered again when the day changes.
+    """
+    schedule = IncrementalSchedule(os.path.basename(json_file), context)
+    renderer = ChartRenderer() if ((output is not None) or (fmt is not None)) else None
+    stop = stop or threading.Event()
+    rendered = None
+    day = schedule.context.today
+    while (not stop.is_set()):
+        try:
+            stat = os.stat(json_file)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            version = None
+
+        if ((context is None) and (pd.Timestamp.today().strftime('%Y-%m-%d') != day)):
+            # Unedited, but the day changed: render again for the new today and range window
+            day = pd.Timestamp.today().strftime('%Y-%m-%d')
+            rendered = None
+        if ((version is not None) and (version != rendered)):
+            # Wait until the file has stopped changing
+            settled = version
+            while (not stop.wait(debounce)):
+                try:
+                    stat = os.stat(json_file)
+                except OSError:
+                    break
+                if ((stat.st_mtime_ns, stat.st_size) == settled):
+                    break
+                settled = (stat.st_mtime_ns, stat.st_size)
+            if (stop.is_set()):
+                break
+            rendered = settled
+            try:
+                changes = schedule.Update(json_file)
+            except ScheduleError as err:
+                print(err)
+                changes = None
+            if (changes is not None):
+                on_render(schedule.Render(output, fmt, renderer), changes)
+        stop.wait(interval)
 
+def ConvertSchedule(json_file, binary_file, stream = False):
+    """Write json_file as a BinarySchedule, which ProgramSchedule loads like JSON."""
+    ps = ProgramSchedule(os.path.basename(json_file))
+    ps.ParseDataFromJSON(json_file, stream)
+    columns = ps.program_columns
+    if (columns is None):
+        columns = ProgramColumns()
+        for program_data in ps.schedule_data['Data']:
+            columns.Append(program_data)
+    header = {k: v for k, v in ps.schedule_data.items() if (k != 'Data')}
+    BinarySchedule.Write(binary_file, header, columns)
+
+def LoadSchedule(ps, json_file, stream = False, cache = None):
+    if (cache is not None):
+        cache.Process(ps, json_file, stream)
+    else:
+        ps.ParseDataFromJSON(json_file, stream)
+        ps.PreparePhaseList()
+        ps.PrepareEventList()
+        ps.ProcessProgramDetails()
+
+def PageOutput(output, number, pages):
+    # chart.svg becomes chart_1.svg, chart_2.svg, ... when there is more than one page
+    if ((output is None) or (pages == 1)):
+        return output
+    if (hasattr(output, 'write')):
+        raise ValueError('Paginated output needs a file path, not a buffer')
+    base, ext = os.path.splitext(output)
+    return '%s_%d%s' %(base, number + 1, ext)
+
+@Instrumented
+def PlotGantt(name, json_file, stream = False, cache = None, output = None, fmt = None, renderer = None, context = None, precompiled = False,
+              page_size = None, window_only = False):
+    ps = ProgramSchedule(name, context)
+    if (os.path.isfile(json_file)):
+        try:
+            LoadSchedule(ps, json_file, stream, cache)
+        except ScheduleError as err:
+            print(err)
+            return
+        PlotSchedule(ps, output, fmt, renderer, precompiled, page_size, window_only)
+    else:
+        print('No program JSON file provided')
+
+def PlotSchedule(ps, output = None, fmt = None, renderer = None, precompiled = False, page_size = None, window_only = False):
+    # Plot a processed schedule, all pages share the header prepared for the first one
+    pages = ps.Paginate(page_size, window_only) if (page_size or window_only) else [ps]
+    header = None
+    for number, page in enumerate(pages):
+        pc = ProgramChart(page)
+        if (header is None):
+            pc.PrepareChartHeader()
+            header = pc
+        else:
+            pc.ShareChartHeader(header)
+
+        if (output is not None):
+            if (not precompiled):
+                pc.PlotChartHeader()
+                pc.PlotChartBody()
+            pc.PlotSave(PageOutput(output, number, len(pages)), fmt, renderer, precompiled)
+        else:
+            pc.PlotChartHeader()
+            pc.PlotChartBody()
+            pc.PlotShow()
+
+def LoadScheduleColumns(json_file, stream = False, context = None):
+    # One file of MergeSchedules: parsed definitions, flattened Data and its parsed dates
+    ps = ProgramSchedule(os.path.basename(json_file), context)
+    ps.ParseDataFromJSON(json_file, stream)
+    ps.PreparePhaseList()
+    ps.PrepareEventList()
+    columns = ps.program_columns
+    if (columns is None):
+        columns = ProgramColumns()
+        for program_data in ps.schedule_data['Data']:
+            columns.Append(program_data)
+    return ps, columns, columns.Dates()
+
+def MergeTypes(pieces, kind):
+    """Combine each file's definitions by Description, returns (definitions, per file Type maps).
+
+    A Description keeps the Type number of its first appearance when that is
+    free, otherwise it gets the next unused one. Colors come from the first
+    file defining the Description.
+    """
+    definitions = {}
+    used = set()
+    maps = []
+    for ps in pieces:
+        type_map = {}
+        for d in (ps.phases if (kind == 'Phase') else ps.events):
+            if (d['Description'] not in definitions):
+                new_type = d['Type'] if (d['Type'] not in used) else max(used) + 1
+                used.add(new_type)
+                definitions[d['Description']] = dict(d, Type = new_type)
+            # First definition of a Type in a file wins, as in ResolveType
+            type_map.setdefault(d['Type'], definitions[d['Description']]['Type'])
+        maps.append(type_map)
+    return list(definitions.values()), maps
+
+def RemapTypes(types, type_map, programs, rows, kind, file):
+    remapped = pd.Series(types, dtype = object).map(type_map)
+    unsupported = remapped.isna().values
+    if (unsupported.any()):
+        row = unsupported.argmax()
+        raise ScheduleError('Unsupported %s type %s for %s in %s' %(kind, types[row], programs[rows[row]], file))
+    return remapped.values.astype(np.int64)
+
+class MergedColumns(ProgramColumns):
+    """ProgramColumns of several files concatenated by MergeSchedules, dates already parsed."""
+
+    def Append(self, program_data):
+        raise TypeError('MergedColumns is read only')
+
+    def Dates(self):
+        return self.dates
+
+def MergeSchedules(json_files, description = 'Merged Schedule', context = None, workers = None, stream = False):
+    """Load several schedule files into one ProgramSchedule.
+
+    Files are loaded on a thread pool. Phase_List and Event_List are merged by
+    Description and each file's Types remapped to the merged ones. Programs are
+    re-indexed 1..N grouped by file, in the order of json_files, keeping each
+    file's Index order. The flattened columns of all files are concatenated
+    once and processed together.
+    """
+    context = context or RenderContext()
+    workers = workers or min(32, len(json_files)) or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        loaded = list(executor.map(LoadScheduleColumns, json_files, [stream] * len(json_files), [context] * len(json_files)))
+
+    pieces = [ps for ps, columns, dates in loaded]
+    phases, phase_maps = MergeTypes(pieces, 'Phase')
+    events, event_maps = MergeTypes(pieces, 'Event')
+
+    fields = {name: [] for name in ('program', 'index', 'phase_row', 'phase_type', 'phase_end_today', 'phase_hide', 'phase_info',
+                                    'event_row', 'event_type', 'event_info', 'event_date_info')}
+    dates = ([], [], [])
+    offset = 0
+    for json_file, (ps, columns, file_dates), phase_map, event_map in zip(json_files, loaded, phase_maps, event_maps):
+        count = len(columns.program)
+        program = np.asarray(columns.program, dtype = object)
+        phase_row = np.asarray(columns.phase_row, dtype = np.intp)
+        event_row = np.asarray(columns.event_row, dtype = np.intp)
+        index = np.empty(count, dtype = np.int64)
+        index[np.argsort(np.asarray(columns.index), kind = 'stable')] = np.arange(offset + 1, offset + count + 1)
+
+        fields['program'].append(program)
+        fields['index'].append(index)
+        fields['phase_row'].append(phase_row + offset)
+        fields['phase_type'].append(RemapTypes(columns.phase_type, phase_map, program, phase_row, 'Phase', json_file))
+        fields['event_row'].append(event_row + offset)
+        fields['event_type'].append(RemapTypes(columns.event_type, event_map, program, event_row, 'Event', json_file))
+        for name in ('phase_end_today', 'phase_hide'):
+            fields[name].append(np.asarray(getattr(columns, name), dtype = bool))
+        for name in ('phase_info', 'event_info', 'event_date_info'):
+            fields[name].append(np.asarray(getattr(columns, name), dtype = object))
+        for merged, file_date in zip(dates, file_dates):
+            merged.append(file_date)
+        offset += count
+
+    # One concatenation per column for all files
+    columns = MergedColumns()
+    for name, arrays in fields.items():
+        setattr(columns, name, np.concatenate(arrays) if (arrays) else np.array([]))
+    columns.dates = tuple(np.concatenate(d) if (d) else np.array([], dtype = 'datetime64[us]') for d in dates)
+
+    ps = ProgramSchedule(description, context)
+    ps.description = description
+    ps.schedule_data = {'Description': description, 'Phase_List': phases, 'Event_List': events}
+    ps.program_columns = columns
+    ps.PreparePhaseList()
+    ps.PrepareEventList()
+    ps.ProcessProgramDetails()
+    return ps
+
+@Instrumented
+def PlotGanttMerged(name, json_files, output = None, fmt = None, renderer = None, context = None, precompiled = False,
+                    workers = None, stream = False, page_size = None, window_only = False):
+    # One chart for many schedule files, see MergeSchedules
+    try:
+        ps = MergeSchedules(json_files, name, context, workers, stream)
+    except (ScheduleError, OSError) as err:
+        print(err)
+        return
+    PlotSchedule(ps, output, fmt, renderer, precompiled, page_size, window_only)
+
+def PlotGanttFiles(json_files, output_dir, fmt = 'svg', stream = False, cache = None, context = None, precompiled = False):
+    # Headless batch: one output per schedule, all sharing one renderer
+    renderer = ChartRenderer()
+    outputs = []
+    for json_file in json_files:
+        output = os.path.join(output_dir, os.path.splitext(os.path.basename(json_file))[0] + '.' + fmt)
+        PlotGantt(os.path.basename(json_file), json_file, stream, cache, output, fmt, renderer, context, precompiled)
+        outputs.append(output)
+    return outputs
+
+# Per worker process state for PlotGanttBatch, set up once by InitBatchWorker
+batch_renderer = None
+batch_cache = None
+
+def InitBatchWorker(cache_dir = None, cache_max_bytes = None):
+    global batch_renderer, batch_cache
+    batch_renderer = ChartRenderer()
+    batch_renderer.Warm()
+    if (cache_dir is not None):
+        batch_cache = ScheduleCache(cache_dir, cache_max_bytes)
+
+def RenderBatchFile(job):
+    json_file, output, fmt, stream, context, precompiled = job
+    result = {'file': json_file, 'output': output, 'seconds': 0.0, 'error': None}
+    start = time.perf_counter()
+    try:
+        ps = ProgramSchedule(os.path.basename(json_file), context)
+        LoadSchedule(ps, json_file, stream, batch_cache)
         pc = ProgramChart(ps)
         pc.PrepareChartHeader()
+        if (not precompiled):
+            pc.PlotChartHeader()
+            pc.PlotChartBody()
+        pc.PlotSave(output, fmt, batch_renderer, precompiled)
+    except Exception as err:
+        # One bad file must not abort the batch, report it instead
+        result['output'] = None
+        result['error'] = '%s: %s' %(type(err).__name__, err)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def SpawnExecutor(workers, initializer = None, initargs = ()):
+    # vl-convert runs its own threads, so fork()ing a process that has used it can deadlock
+    return concurrent.futures.ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn'),
+                                                  initializer = initializer, initargs = initargs)
+
+def PlotGanttBatch(json_files, output_dir, fmt = 'svg', workers = None, stream = False, cache = None, context = None, precompiled = False):
+    """Render many schedule files in parallel with a process pool.
+
+    Each worker keeps one warm ChartRenderer (and its own ScheduleCache handle
+    when cache is given) for all the files it is handed. Returns one result
+    dict per input file, in input order, with output path, seconds and error.
+    """
+    jobs = [(json_file, os.path.join(output_dir, os.path.splitext(os.path.basename(json_file))[0] + '.' + fmt), fmt, stream, context or RenderContext(), precompiled)
+            for json_file in json_files]
+    workers = workers or os.cpu_count() or 1
+    initargs = (cache.cache_dir, cache.max_bytes) if (cache is not None) else ()
+    with SpawnExecutor(workers, InitBatchWorker, initargs) as executor:
+        chunksize = max(1, len(jobs) // (workers * 4))
+        return list(executor.map(RenderBatchFile, jobs, chunksize = chunksize))
+
+def RenderScheduleData(job):
+    # Worker side of RenderService: schedule dict in, rendered bytes out, errors raised
+    schedule_data, fmt, context, precompiled = job
+    global batch_renderer
+    if (batch_renderer is None):
+        batch_renderer = ChartRenderer()
+    ps = ProgramSchedule('Service', context)
+    try:
+        ps.ParseData(schedule_data)
+        ps.PreparePhaseList()
+        ps.PrepareEventList()
+        ps.ProcessProgramDetails()
+    except (KeyError, TypeError, ValueError) as err:
+        # Malformed programs would otherwise surface as internal errors
+        raise ScheduleError('Invalid schedule data: %s: %s' %(type(err).__name__, err)) from err
+    pc = ProgramChart(ps)
+    pc.PrepareChartHeader()
+    if (not precompiled):
         pc.PlotChartHeader()
         pc.PlotChartBody()
-        pc.PlotShow()
-    else:
-        print('No program JSON file provided')
+    return batch_renderer.Render(pc.BuildSpec(precompiled), fmt)
+
+class RenderBusy(Exception):
+    """RenderService has max_waiting requests queued already, try again later."""
+    pass
+
+class RenderService():
+    """Asyncio front end rendering schedules on a bounded worker pool.
+
+    At most max_pending renders are handed to the pool at a time. Later requests
+    wait for a slot (backpressure), and once max_waiting are waiting new ones
+    fail with RenderBusy. Identical requests share one render while it is in
+    flight. Outputs are kept in an LRU cache of up to cache_bytes, keyed by the
+    normalized schedule, format, range window, today and colors. Workers are
+    processes by default, processes = False uses threads instead.
+    """
+
+    def __init__(self, workers = None, max_pending = None, max_waiting = None, cache_bytes = 64 * 2**20,
+                 context = None, precompiled = True, processes = True):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.max_waiting = max_waiting
+        self.cache_bytes = cache_bytes
+        self.context = context
+        self.precompiled = precompiled
+        self.processes = processes
+        self.executor = None
+        self.loop = None
+        self.slots = None
+        self.waiting = 0
+        self.in_flight = {}
+        self.cache = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.stats = collections.Counter()
+
+    def Start(self):
+        if (self.executor is None):
+            if (self.processes):
+                self.executor = SpawnExecutor(self.workers, InitBatchWorker)
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.workers)
+        # The slots and in-flight tasks belong to one event loop, a service reused by a later asyncio.run() starts over
+        loop = asyncio.get_running_loop()
+        if (self.loop is not loop):
+            self.loop = loop
+            self.slots = asyncio.Semaphore(self.max_pending)
+            self.waiting = 0
+            self.in_flight = {}
+
+    def Close(self):
+        if (self.executor is not None):
+            self.executor.shutdown()
+            self.executor = None
+
+    def Key(self, schedule_data, fmt, context):
+        normalized = json.dumps(schedule_data, sort_keys = True, separators = (',', ':'))
+        settings = json.dumps([fmt, self.precompiled, context.range_start, context.range_end, context.today,
+                               context.chart_color_bg, context.chart_color_fg, context.today_color,
+                               context.quarter_color_bg, context.quarter_color_fg,
+                               list(context.month_color_bg), context.month_color_fg, list(context.bands)])
+        return hashlib.sha256((settings + normalized).encode('utf-8')).hexdigest()
+
+    async def Render(self, data, fmt = 'svg', context = None):
+        """Render a schedule (dict, or JSON text) and return the output bytes."""
+        if (fmt not in ChartRenderer.FORMATS):
+            raise ValueError('Unsupported output format %s, expect one of %s' %(fmt, ', '.join(ChartRenderer.FORMATS)))
+        if (isinstance(data, (str, bytes))):
+            try:
+                data = json.loads(data)
+            except ValueError as err:
+                raise ScheduleError('Invalid JSON for data') from err
+        context = context or self.context or RenderContext()
+        key = self.Key(data, fmt, context)
+
+        if (key in self.cache):
+            self.cache.move_to_end(key)
+            self.stats['hit'] += 1
+            return self.cache[key]
+        self.Start()
+        if (key in self.in_flight):
+            self.stats['coalesced'] += 1
+        else:
+            # The render runs in its own task, so a caller going away doesn't cancel it for the others
+            task = asyncio.ensure_future(self.Compute(key, data, fmt, context))
+            self.in_flight[key] = task
+            # Retrieved here, so a failure nobody awaited isn't reported as unhandled
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(self.in_flight[key])
+
+    async def Compute(self, key, data, fmt, context):
+        try:
+            output = await self.Submit(data, fmt, context)
+            self.Store(key, output)
+            return output
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def Submit(self, data, fmt, context):
+        if ((self.max_waiting is not None) and self.slots.locked() and (self.waiting >= self.max_waiting)):
+            self.stats['busy'] += 1
+            raise RenderBusy('%d renders waiting' %(self.waiting))
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.stats['render'] += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, RenderScheduleData, (data, fmt, context, self.precompiled))
+        finally:
+            self.slots.release()
+
+    def Store(self, key, output):
+        if (len(output) > self.cache_bytes):
+            return
+        self.cache[key] = output
+        self.cached_bytes += len(output)
+        while (self.cached_bytes > self.cache_bytes):
+            _, evicted = self.cache.popitem(last = False)
+            self.cached_bytes -= len(evicted)
+
+# Shared by RenderGantt calls that don't pass a service
+default_service = None
+
+async def RenderGantt(data, fmt = 'svg', context = None, service = None):
+    """await RenderGantt(schedule_data, 'svg') renders without blocking the event loop."""
+    global default_service
+    if (service is None):
+        if (default_service is None):
+            default_service = RenderService()
+        service = default_service
+    return await service.Render(data, fmt, context)
+
+CONTENT_TYPES = {'svg': 'image/svg+xml', 'png': 'image/png', 'html': 'text/html; charset=utf-8'}
+
+async def HandleRequest(reader, writer, service):
+    # Minimal HTTP/1.1: POST /render?fmt=svg with the schedule JSON as body, one request per connection
+    status, content_type, body = 500, 'text/plain', b''
+    try:
+        request = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if (not line):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        method, target = (request + ['', ''])[:2]
+        path, _, query = target.partition('?')
+        params = dict(item.partition('=')[::2] for item in query.split('&') if item)
+        if ((method, path) == ('GET', '/stats')):
+            status, content_type, body = 200, 'application/json', json.dumps(dict(service.stats)).encode()
+        elif ((method, path) != ('POST', '/render')):
+            status, body = 404, b'POST /render?fmt=svg|png|html'
+        else:
+            data = await reader.readexactly(int(headers.get('content-length', 0)))
+            fmt = params.get('fmt', 'svg')
+            body = await service.Render(data, fmt)
+            status, content_type = 200, CONTENT_TYPES[fmt]
+    except (ScheduleError, ValueError) as err:
+        status, body = 400, str(err).encode()
+    except RenderBusy as err:
+        status, body = 503, str(err).encode()
+    except Exception as err:
+        status, body = 500, ('%s: %s' %(type(err).__name__, err)).encode()
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                  %(status, reasons[status], content_type, len(body))).encode('latin-1') + body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def ServeGantt(host = '127.0.0.1', port = 8080, service = None):
+    """Local HTTP stand-in for a chart service, returns the started asyncio server."""
+    service = service or RenderService()
+    service.Start()
+    return await asyncio.start_server(lambda reader, writer: HandleRequest(reader, writer, service), host, port)
@@ -0,0 +1,789 @@
+#!/usr/bin/env python
+# Performance benchmarks for PrettyGantt, run offline against synthetic schedules.
+#
+#   python benchmark.py process [--rows 1000 10000 100000]
+#   python benchmark.py memory [--programs 20000]
+#   python benchmark.py cache [--programs 20000]
+#   python benchmark.py batch [--files 16 --programs 50 --workers 4]
+#   python benchmark.py repeat [--charts 1000 --threads 4 --fmt svg]
+#   python benchmark.py spec [--programs 10 100 1000 5000 --repeat 5]
+#   python benchmark.py startup [--module PrettyGantt]
+#   python benchmark.py index [--phases 100000 --queries 200]
+#   python benchmark.py incremental [--programs 3000 --edits 2 --rounds 5]
+#   python benchmark.py binary [--phases 1000000]
+#   python benchmark.py merge [--files 200 --programs 15 --workers 1 4]
+#   python benchmark.py serve [--requests 400 --concurrency 16 --distinct 40 --workers 2]
+#   python benchmark.py hooks [--programs 200 --repeat 20]
+#   python benchmark.py header [--charts 500]
+#   python benchmark.py stages [--programs 1000 --outside 0.2 --fmt svg --repeat 3 --output results.json]
+
+import os, sys, json, asyncio, collections, concurrent.futures, multiprocessing, subprocess, argparse, random, time, tempfile, tracemalloc, gc, shutil, resource
+import numpy as np
+import pandas as pd
+import PrettyGantt
+
+def GenerateSchedule(programs, phases = 3, events = 4, seed = 0, spread = 600, outside = 0.0, context = None):
+    # Programs start within spread days from a year ago. A share of outside programs is
+    # moved wholly before or after the context's range, with no open ended dates.
+    rng = random.Random(seed)
+    base = pd.Timestamp.today().normalize() - pd.Timedelta(days = 365)
+    if (outside):
+        context = context or PrettyGantt.RenderContext()
+        extent = pd.Timedelta(days = max(spread + 200 * phases, spread + 300))
+        before = pd.Timestamp(context.range_start) - extent - pd.Timedelta(days = 1)
+        after = pd.Timestamp(context.range_end) + pd.Timedelta(days = 1)
+    data = []
+    for i in range(programs):
+        origin = base
+        out = bool(outside) and (rng.random() < outside)
+        if (out):
+            origin = before if (rng.random() < 0.5) else after
+        day = rng.randrange(0, spread)
+        phase_list = []
+        for p in range(phases):
+            length = rng.randrange(20, 200)
+            phase_list.append({'Type': (p % 3) + 1,
+                               'Start': '' if (p == 0 and rng.random() < 0.1 and not out) else (origin + pd.Timedelta(days = day)).strftime('%Y-%m-%d'),
+                               'End': '' if (p == phases - 1 and rng.random() < 0.1 and not out) else (origin + pd.Timedelta(days = day + length)).strftime('%Y-%m-%d'),
+                               'Hide_Description': rng.random() < 0.5})
+            if (rng.random() < 0.1):
+                phase_list[-1]['Additional Info'] = ' (TBD)'
+            day += length
+        event_list = []
+        for e in range(events):
+            event_list.append({'Type': (e % 4) + 1,
+                               'Date': (origin + pd.Timedelta(days = rng.randrange(0, spread + 300))).strftime('%Y-%m-%d')})
+            if (rng.random() < 0.1):
+                event_list[-1]['Additional Date Info'] = ' (TBC)'
+        data.append({'Program': 'Program %d' %(i + 1), 'Index': i + 1, 'Phase': phase_list, 'Event': event_list})
+
+    return {'Description': 'Synthetic %d programs' %(programs),
+            'Phase_List': [{'Type': 1, 'Description': 'Develop', 'BGColor': '#513B56', 'FGColor': '#FFFFFF'},
+                           {'Type': 2, 'Description': 'Testing', 'BGColor': '#348AA7', 'FGColor': '#000000'},
+                           {'Type': 3, 'Description': 'Release', 'BGColor': '#BCE784', 'FGColor': '#000000'}],
+            'Event_List': [{'Type': 1, 'Description': 'Alpha', 'BGColor': '#FFC75F', 'FGColor': '#000000'},
+                           {'Type': 2, 'Description': 'Beta', 'BGColor': '#FF9671', 'FGColor': '#000000'},
+                           {'Type': 3, 'Description': 'RC', 'BGColor': '#FF6F91', 'FGColor': '#000000'},
+                           {'Type': 4, 'Description': 'Release', 'BGColor': '#D65DB1', 'FGColor': '#000000'}],
+            'Data': data}
+
+def LegacyProcessProgramDetails(ps):
+    # Row-at-a-time reference implementation of ProcessProgramDetails, kept for comparison
+    program_bar_name_list = []
+    program_bar_range_list = []
+    program_bar_event_list = []
+    RANGE_START = ps.context.range_start
+    RANGE_END = ps.context.range_end
+
+    for program_data in ps.schedule_data['Data']:
+        program_bar_name_list.append({'Program': program_data['Program'], 'Index': program_data['Index'], 'FGColor': ps.context.chart_color_fg})
+
+        if 'Phase' in program_data:
+            for program_phase in program_data['Phase']:
+                for p in ps.phases:
+                    if (p['Type'] == program_phase['Type']):
+                        break
+                entry = {'Program': program_data['Program'],
+                         'Index': program_data['Index'],
+                         'Type': p['Description'],
+                         'Start': ((pd.to_datetime(RANGE_START)) if (pd.to_datetime(program_phase['Start']) < pd.to_datetime(RANGE_START)) else (pd.to_datetime(program_phase['Start']))) if (program_phase['Start'] != '') else (pd.to_datetime(RANGE_START)),
+                         'End' : ((pd.to_datetime(RANGE_END)) if (pd.to_datetime(program_phase['End']) > pd.to_datetime(RANGE_END)) else (pd.to_datetime(program_phase['End']))) if (program_phase['End'] != '') else (pd.to_datetime(RANGE_END)),
+                         'BGColor': p['BGColor'],
+                         'FGColor': p['FGColor'],
+                         'Description': ''
+                        }
+                if (('End_Today' in program_phase) and program_phase['End_Today']):
+                    entry['End'] = pd.to_datetime(ps.context.today)
+                if (not program_phase['Hide_Description']):
+                    entry['Description'] = (p['Description'] + str(program_phase['Additional Info'])) if ('Additional Info' in program_phase) else (p['Description'])
+                program_bar_range_list.append(entry)
+
+        if 'Event' in program_data:
+            for program_event in program_data['Event']:
+                for e in ps.events:
+                    if (e['Type'] == program_event['Type']):
+                        break
+                entry = {'Program': program_data['Program'],
+                         'Index': program_data['Index'],
+                         'Type': e['Description'],
+                         'Date': pd.to_datetime(program_event['Date']),
+                         'BGColor': e['BGColor'],
+                         'FGColor': e['FGColor'],
+                         'Description': (e['Description'] + str(program_event['Additional Info'])) if ('Additional Info' in program_event) else (e['Description']),
+                         'Date_Short': str(pd.to_datetime(program_event['Date']).strftime('%m/%d') + ((str(program_event['Additional Date Info'])) if ('Additional Date Info' in program_event) else ('')))
+                        }
+                program_bar_event_list.append(entry)
+
+    return program_bar_name_list, program_bar_range_list, program_bar_event_list
+
+def LoadSchedule(schedule_data):
+    ps = PrettyGantt.ProgramSchedule('Benchmark')
+    ps.schedule_data = schedule_data
+    ps.PreparePhaseList()
+    ps.PrepareEventList()
+    return ps
+
+def Timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def BenchProcess(args):
+    print('%10s %12s %12s %9s' %('rows', 'loop (s)', 'columnar (s)', 'speedup'))
+    for rows in args.rows:
+        ps = LoadSchedule(GenerateSchedule(max(1, rows // 3), phases = 3, events = 1))
+        loop_time, expected = Timed(LegacyProcessProgramDetails, ps)
+        columnar_time, _ = Timed(ps.ProcessProgramDetails)
+        if ((ps.program_bar_name_list, ps.program_bar_range_list, ps.program_bar_event_list) != expected):
+            print('Columnar output differs from loop output at %d rows' %(rows))
+            sys.exit(1)
+        print('%10d %12.3f %12.3f %8.1fx' %(len(expected[1]), loop_time, columnar_time, loop_time / columnar_time))
+
+def WriteSchedule(schedule_data):
+    fd, path = tempfile.mkstemp(suffix = '.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(schedule_data, f)
+    return path
+
+def PeakMemory(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def LoadAndProcess(json_file, stream):
+    ps = PrettyGantt.ProgramSchedule('Benchmark')
+    ps.ParseDataFromJSON(json_file, stream)
+    ps.PreparePhaseList()
+    ps.PrepareEventList()
+    ps.ProcessProgramDetails()
+    return ps
+
+def BenchMemory(args):
+    json_file = WriteSchedule(GenerateSchedule(args.programs))
+    try:
+        size = os.path.getsize(json_file)
+        print('%d programs, %.1f MB JSON' %(args.programs, size / 2**20))
+        print('%10s %10s %14s %10s' %('loader', 'time (s)', 'peak (MB)', 'x file'))
+        for label, stream in (('json.load', False), ('stream', True)):
+            elapsed, peak = PeakMemory(LoadAndProcess, json_file, stream)
+            print('%10s %10.2f %14.1f %10.1f' %(label, elapsed, peak / 2**20, peak / size))
+    finally:
+        os.remove(json_file)
+
+def BenchCache(args):
+    schedule_data = GenerateSchedule(args.programs)
+    # Values the cache has to give back as they were: a missing event date, an int program name
+    schedule_data['Data'][0]['Event'][0]['Date'] = ''
+    schedule_data['Data'][-1]['Program'] = len(schedule_data['Data'])
+    json_file = WriteSchedule(schedule_data)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = PrettyGantt.ScheduleCache(cache_dir)
+        print('%d programs, %.1f MB JSON' %(args.programs, os.path.getsize(json_file) / 2**20))
+        print('%10s %10s' %('run', 'time (s)'))
+        elapsed, expected = Timed(LoadAndProcess, json_file, False)
+        print('%10s %10.3f' %('no cache', elapsed))
+        for label in ('cold', 'warm'):
+            ps = PrettyGantt.ProgramSchedule('Benchmark')
+            elapsed, _ = Timed(cache.Process, ps, json_file)
+            print('%10s %10.3f' %(label, elapsed))
+        for table in PrettyGantt.ProgramSchedule.TABLES:
+            if (not (getattr(ps, table).equals(getattr(expected, table)) and getattr(ps, table).dtypes.equals(getattr(expected, table).dtypes))):
+                print('Cached %s differs from the uncached table' %(table))
+                sys.exit(1)
+        # Same content under a new mtime: fast path misses, content hash hits
+        os.utime(json_file)
+        elapsed, _ = Timed(cache.Process, PrettyGantt.ProgramSchedule('Benchmark'), json_file)
+        print('%10s %10.3f' %('touched', elapsed))
+    finally:
+        os.remove(json_file)
+        shutil.rmtree(cache_dir)
+
+def BenchBatch(args):
+    work_dir = tempfile.mkdtemp()
+    try:
+        json_files = []
+        for i in range(args.files):
+            json_file = os.path.join(work_dir, 'team%d.json' %(i))
+            with open(json_file, 'w') as f:
+                json.dump(GenerateSchedule(args.programs, seed = i), f)
+            json_files.append(json_file)
+
+        print('%d files x %d programs, %d workers' %(args.files, args.programs, args.workers))
+        elapsed, _ = Timed(PrettyGantt.PlotGanttFiles, json_files, work_dir, 'svg')
+        print('%12s %10.2f s' %('sequential', elapsed))
+        elapsed, results = Timed(PrettyGantt.PlotGanttBatch, json_files, work_dir, 'svg', args.workers)
+        print('%12s %10.2f s' %('pool', elapsed))
+        errors = [r for r in results if r['error'] is not None]
+        if (errors):
+            print('%d files failed, first: %s' %(len(errors), errors[0]['error']))
+    finally:
+        shutil.rmtree(work_dir)
+
+def BuildChartJSON(json_file, context, renderer, fmt):
+    ps = PrettyGantt.ProgramSchedule('Benchmark', context)
+    PrettyGantt.LoadSchedule(ps, json_file)
+    pc = PrettyGantt.ProgramChart(ps)
+    pc.PrepareChartHeader()
+    pc.PlotChartHeader()
+    pc.PlotChartBody()
+    spec = pc.BuildSpec()
+    return renderer.Render(spec, fmt) if (renderer is not None) else json.dumps(spec)
+
+def BenchRepeat(args):
+    # Many charts in one process must neither leak state into each other nor grow memory
+    json_file = WriteSchedule(GenerateSchedule(args.programs))
+    context = PrettyGantt.RenderContext()
+    renderer = PrettyGantt.ChartRenderer() if (args.fmt is not None) else None
+    try:
+        expected = BuildChartJSON(json_file, context, renderer, args.fmt)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        mismatch = 0
+        peaks = []
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers = args.threads) as executor:
+            for done in range(0, args.charts, 100):
+                count = min(100, args.charts - done)
+                outputs = executor.map(BuildChartJSON, [json_file] * count, [context] * count, [renderer] * count, [args.fmt] * count)
+                mismatch += sum(output != expected for output in outputs)
+                peaks.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+                print('%6d charts, peak RSS +%d KB' %(done + count, peaks[-1] - baseline))
+        print('%d charts in %.1f s on %d threads, %d differ from the first' %(args.charts, time.perf_counter() - start, args.threads, mismatch))
+        # The first 100 charts warm up caches and the allocator, after that memory has to stay flat
+        growth = peaks[-1] - peaks[0]
+        limit = max(args.max_growth * peaks[0] / 100, 1024)
+        print('peak RSS grew %d KB after the first 100 charts (limit %d KB)' %(growth, limit))
+        if (mismatch or (growth > limit)):
+            sys.exit(1)
+    finally:
+        os.remove(json_file)
+
+def BenchSpec(args):
+    # Build-spec time per chart: full Altair build vs precompiled template (first compile excluded)
+    print('%10s %12s %12s %16s' %('programs', 'spec (KB)', 'altair (ms)', 'precompiled (ms)'))
+    for programs in args.programs:
+        ps = LoadSchedule(GenerateSchedule(programs))
+        ps.ProcessProgramDetails()
+        PrettyGantt.GetSpecTemplate(ps.context, not args.no_prune)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            pc = PrettyGantt.ProgramChart(ps, prune_columns = not args.no_prune)
+            pc.PrepareChartHeader()
+            pc.PlotChartHeader()
+            pc.PlotChartBody()
+            spec = json.dumps(pc.BuildSpec())
+        altair_time = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            pc = PrettyGantt.ProgramChart(ps, prune_columns = not args.no_prune)
+            pc.PrepareChartHeader()
+            precompiled = json.dumps(pc.BuildSpec(precompiled = True))
+        precompiled_time = (time.perf_counter() - start) / args.repeat
+
+        if (json.loads(spec) != json.loads(precompiled)):
+            print('Precompiled spec differs at %d programs' %(programs))
+            sys.exit(1)
+        print('%10d %12.1f %12.1f %16.1f' %(programs, len(spec) / 2**10, altair_time * 1000, precompiled_time * 1000))
+
+def BenchStartup(args):
+    # python -X importtime reports self and cumulative microseconds per imported module,
+    # nesting shown by indentation of the name
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' %(args.module)],
+                            capture_output = True, text = True, check = True,
+                            cwd = os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line[len('import time:'):].split('|')
+        if (not line.startswith('import time:') or (len(fields) != 3) or not fields[1].strip().isdigit()):
+            continue
+        depth = (len(fields[2]) - len(fields[2].lstrip()) - 1) // 2
+        imports.append((depth, int(fields[1]), fields[2].strip()))
+
+    total = sum(us for depth, us, name in imports if (depth == 0) and (name == args.module))
+    print('import %s: %.1f ms' %(args.module, total / 1000))
+    for depth, us, name in sorted([i for i in imports if i[0] == 1], key = lambda i: -i[1])[:args.top]:
+        print('%10.1f ms  %s' %(us / 1000, name))
+    print('altair imported: %s' %(any(name == 'altair' for _, _, name in imports)))
+
+def BenchIndex(args):
+    ps = LoadSchedule(GenerateSchedule(max(1, args.phases // 3), phases = 3, events = 1))
+    ps.ProcessProgramDetails()
+    span = ps.program_bar_span_table
+    rng = np.random.default_rng(0)
+    # Some spans end before they start (End_Today before a future Start, typos), their bars cover [End, Start]
+    raw_starts = PrettyGantt.DateKeys(span['Start'], PrettyGantt.OPEN_START)
+    raw_ends = PrettyGantt.DateKeys(span['End'], PrettyGantt.OPEN_END)
+    inverted = rng.random(len(span)) < args.inverted
+    raw_starts[inverted], raw_ends[inverted] = raw_ends[inverted], raw_starts[inverted].copy()
+    build_time, phase_index = Timed(PrettyGantt.ScheduleIndex, raw_starts, raw_ends)
+    starts, ends = np.minimum(raw_starts, raw_ends), np.maximum(raw_starts, raw_ends)
+    print('%d phases (%d inverted), index built in %.3f s' %(len(span), inverted.sum(), build_time))
+
+    low, high = np.percentile(starts[starts != PrettyGantt.OPEN_START], [0, 100]).astype(np.int64)
+    windows = []
+    for i in range(args.queries):
+        start = int(rng.integers(low, high))
+        windows.append((start, start + int(rng.integers(0, 30)) * 86400 * 10**9))
+
+    def QueryIndex():
+        return [phase_index.QueryWindow(start, end) for start, end in windows]
+    def QueryMask():
+        return [np.flatnonzero((starts <= end) & (ends >= start)) for start, end in windows]
+    def QueryScan():
+        pairs = list(zip(starts.tolist(), ends.tolist()))
+        return [[row for row, (s, e) in enumerate(pairs) if (s <= end) and (e >= start)] for start, end in windows[:args.scan]]
+
+    index_time, found = Timed(QueryIndex)
+    mask_time, expected = Timed(QueryMask)
+    scan_time, scanned = Timed(QueryScan)
+    if (any(not np.array_equal(a, b) for a, b in zip(found, expected)) or
+        any(list(a) != b for a, b in zip(found, scanned))):
+        print('Interval index results differ from scan')
+        sys.exit(1)
+    hits = sum(len(rows) for rows in found) / len(found)
+    print('%-12s %12s  (%d windows, %.0f phases each)' %('method', 'ms/query', len(windows), hits))
+    print('%-12s %12.3f' %('index', index_time * 1000 / len(windows)))
+    print('%-12s %12.3f' %('numpy mask', mask_time * 1000 / len(windows)))
+    print('%-12s %12.3f' %('python scan', scan_time * 1000 / min(args.scan, len(windows))))
+
+def BenchIncremental(args):
+    # Each round edits a few programs, then compares a full reload and spec build
+    # against IncrementalSchedule.Update on the same file
+    context = PrettyGantt.RenderContext()
+    schedule_data = GenerateSchedule(args.programs)
+    json_file = WriteSchedule(schedule_data)
+    incremental = PrettyGantt.IncrementalSchedule('bench', context)
+    incremental.Update(json_file)
+    rng = random.Random(1)
+    print('%6s %10s %14s %9s' %('round', 'full (s)', 'incremental (s)', 'speedup'))
+    try:
+        for round in range(args.rounds):
+            for program_data in rng.sample(schedule_data['Data'], args.edits):
+                program_data['Phase'][0]['Start'] = (pd.Timestamp(context.today) - pd.Timedelta(days = rng.randrange(1, 300))).strftime('%Y-%m-%d')
+            with open(json_file, 'w') as f:
+                json.dump(schedule_data, f)
+
+            def FullBuild():
+                ps = PrettyGantt.ProgramSchedule('bench', context)
+                PrettyGantt.LoadSchedule(ps, json_file)
+                pc = PrettyGantt.ProgramChart(ps)
+                pc.PrepareChartHeader()
+                return pc.BuildSpec(precompiled = True)
+            full_time, expected = Timed(FullBuild)
+            incremental_time, _ = Timed(incremental.Update, json_file)
+            if (json.dumps(incremental.spec) != json.dumps(expected)):
+                print('Incremental spec differs from full rebuild in round %d' %(round))
+                sys.exit(1)
+            print('%6d %10.3f %14.3f %8.1fx' %(round, full_time, incremental_time, full_time / incremental_time))
+    finally:
+        os.remove(json_file)
+
+def CurrentRSS():
+    # Resident set size in MB (Linux)
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+def MeasureLoad(path):
+    # Runs in a fresh process, so RSS growth is this load alone (ru_maxrss is KB on Linux)
+    baseline = CurrentRSS()
+    ps = PrettyGantt.ProgramSchedule('Benchmark')
+    parse_time, _ = Timed(ps.ParseDataFromJSON, path)
+    parsed = CurrentRSS() - baseline
+    ps.PreparePhaseList()
+    ps.PrepareEventList()
+    process_time, _ = Timed(ps.ProcessProgramDetails)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline
+    return parse_time, process_time, parsed, peak, len(ps.program_bar_range_table)
+
+def BenchBinary(args):
+    json_file = WriteSchedule(GenerateSchedule(max(1, args.phases // 3), phases = 3))
+    binary_file = os.path.splitext(json_file)[0] + '.pgb'
+    try:
+        convert_time, _ = Timed(PrettyGantt.ConvertSchedule, json_file, binary_file, True)
+        print('converted in %.1f s' %(convert_time))
+        print('%8s %10s %10s %12s %16s %14s' %('format', 'size (MB)', 'parse (s)', 'process (s)', 'parsed RSS (MB)', 'peak RSS (MB)'))
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        for label, path in (('json', json_file), ('binary', binary_file)):
+            with concurrent.futures.ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+                parse_time, process_time, parsed, peak, phases = executor.submit(MeasureLoad, path).result()
+            results[label] = phases
+            print('%8s %10.1f %10.2f %12.2f %16.1f %14.1f' %(label, os.path.getsize(path) / 2**20, parse_time, process_time, parsed, peak))
+        if (results['json'] != results['binary']):
+            print('Binary schedule has %d phases, JSON %d' %(results['binary'], results['json']))
+            sys.exit(1)
+    finally:
+        for path in (json_file, binary_file):
+            if (os.path.exists(path)):
+                os.remove(path)
+
+def Versions():
+    # Recorded with stage results so runs of different versions can be told apart
+    versions = {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__}
+    for module in ('altair', 'vl_convert', 'ijson'):
+        try:
+            versions[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            versions[module] = None
+    try:
+        versions['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True,
+                                            cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        versions['commit'] = None
+    return versions
+
+def RunStages(json_file, args, renderer):
+    # One pass through the pipeline, returns {stage: (seconds, peak RSS in MB so far)}
+    stages = {}
+    def Stage(name, func, *func_args):
+        elapsed, result = Timed(func, *func_args)
+        stages[name] = (elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        return result
+
+    ps = PrettyGantt.ProgramSchedule('Benchmark')
+    Stage('parse', ps.ParseDataFromJSON, json_file, args.stream)
+    def PrepareLists():
+        ps.PreparePhaseList()
+        ps.PrepareEventList()
+    Stage('prepare_lists', PrepareLists)
+    Stage('process', ps.ProcessProgramDetails)
+    def PrepareHeader():
+        pc = PrettyGantt.ProgramChart(ps)
+        pc.PrepareChartHeader()
+        return pc
+    pc = Stage('header', PrepareHeader)
+    def BuildSpec():
+        if (not args.precompiled):
+            pc.PlotChartHeader()
+            pc.PlotChartBody()
+        return pc.BuildSpec(args.precompiled)
+    spec = Stage('spec', BuildSpec)
+    spec_bytes = len(json.dumps(spec))
+    output_bytes = None
+    if (renderer is not None):
+        output_bytes = len(Stage('render', renderer.Render, spec, args.fmt))
+    return stages, spec_bytes, output_bytes
+
+def BenchStages(args):
+    schedule_data = GenerateSchedule(args.programs, args.phases, args.events, args.seed, args.spread, args.outside)
+    json_file = WriteSchedule(schedule_data)
+    renderer = None
+    if (args.fmt is not None):
+        renderer = PrettyGantt.ChartRenderer()
+        renderer.Warm()
+    # ProgramChart imports Altair on first use, keep that out of the header stage time and peak RSS
+    PrettyGantt.LoadAltair()
+    try:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        runs = []
+        for run in range(args.repeat):
+            gc.collect()
+            stages, spec_bytes, output_bytes = RunStages(json_file, args, renderer)
+            runs.append(stages)
+
+        results = {'versions': Versions(),
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'params': {'programs': args.programs, 'phases': args.phases, 'events': args.events, 'seed': args.seed,
+                              'spread': args.spread, 'outside': args.outside, 'stream': args.stream,
+                              'precompiled': args.precompiled, 'fmt': args.fmt, 'repeat': args.repeat},
+                   'json_bytes': os.path.getsize(json_file),
+                   'spec_bytes': spec_bytes,
+                   'output_bytes': output_bytes,
+                   'stages': {}}
+        print('%d programs, %d phases, %d events, %.1f MB JSON' %(args.programs, args.programs * args.phases, args.programs * args.events,
+                                                                   results['json_bytes'] / 2**20))
+        print('%-14s %10s %10s %16s' %('stage', 'median (s)', 'min (s)', 'peak RSS (MB)'))
+        for stage in runs[0]:
+            seconds = [stages[stage][0] for stages in runs]
+            # High-water mark above the starting RSS, first run is the one that sets it
+            peak = runs[0][stage][1] - baseline
+            results['stages'][stage] = {'median': float(np.median(seconds)), 'min': min(seconds), 'runs': seconds, 'peak_rss_mb': peak}
+            print('%-14s %10.3f %10.3f %16.1f' %(stage, np.median(seconds), min(seconds), peak))
+        total = sum(stage['median'] for stage in results['stages'].values())
+        print('%-14s %10.3f' %('total', total))
+
+        if (args.output is not None):
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent = 2)
+            print('results written to %s' %(args.output))
+    finally:
+        os.remove(json_file)
+
+def BenchHooks(args):
+    # Cost of the instrumentation when no hook is installed, and with StageMetrics collecting
+    def Plain():
+        pass
+    calls = 1000000
+    plain_time, _ = Timed(lambda: [Plain() for i in range(calls)])
+    wrapped = PrettyGantt.Instrumented(Plain)
+    wrapped_time, _ = Timed(lambda: [wrapped() for i in range(calls)])
+    print('no hook installed: %.0f ns per instrumented call' %((wrapped_time - plain_time) * 1e9 / calls))
+
+    json_file = WriteSchedule(GenerateSchedule(args.programs))
+    context = PrettyGantt.RenderContext()
+    try:
+        BuildChartJSON(json_file, context, None, None)
+        metrics = PrettyGantt.StageMetrics()
+        times = {'none': [], 'metrics': []}
+        for run in range(args.repeat):
+            times['none'].append(Timed(BuildChartJSON, json_file, context, None, None)[0])
+            with PrettyGantt.StageHook(metrics):
+                times['metrics'].append(Timed(BuildChartJSON, json_file, context, None, None)[0])
+        for label, seconds in times.items():
+            print('%-8s median %.4f s per chart' %(label, np.median(seconds)))
+        print('overhead with StageMetrics: %+.1f%%' %((np.median(times['metrics']) / np.median(times['none']) - 1) * 100))
+        print(metrics.PrometheusText().splitlines()[2])
+    finally:
+        os.remove(json_file)
+
+def LegacyChartHeader(context):
+    # Row-at-a-time reference implementation of the quarter and month header, kept for comparison
+    head_bar_list_q = []
+    for quarter in pd.date_range(context.range_start, context.range_end, freq = 'QS'):
+        head_bar_list_q.append({'Program': 'Quarter',
+                                'Index': 0,
+                                'Start': pd.to_datetime(quarter.strftime('%Y-%m-%d')),
+                                'End': pd.to_datetime((quarter + pd.tseries.offsets.QuarterEnd(1)).strftime('%Y-%m-%d')),
+                                'BGColor': context.quarter_color_bg,
+                                'FGColor': context.quarter_color_fg,
+                                'Description': str(quarter.year) + 'Q' + str(quarter.quarter)})
+    head_bar_list_m = []
+    for position, month in enumerate(pd.date_range(context.range_start, context.range_end, freq = 'MS')):
+        head_bar_list_m.append({'Program': 'Month',
+                                'Index': 1,
+                                'Start': pd.to_datetime(month.strftime('%Y-%m-%d')),
+                                'End': pd.to_datetime((month + pd.tseries.offsets.MonthEnd(1)).strftime('%Y-%m-%d')),
+                                'BGColor': context.month_color_bg[position % len(context.month_color_bg)],
+                                'FGColor': context.month_color_fg,
+                                'Description': month.strftime('%m')})
+    return pd.DataFrame(head_bar_list_q + head_bar_list_m)
+
+def BenchHeader(args):
+    # Header table and dataset records per chart: row loop vs HeaderBand, cold and from the GetHeaderBand cache
+    context = PrettyGantt.RenderContext()
+    columns = ['Start', 'End', 'Index', 'BGColor', 'FGColor', 'Description']
+    expected = LegacyChartHeader(context)
+    band = PrettyGantt.HeaderBand(context)
+    if (not band.table[expected.columns].equals(expected.astype(band.table[expected.columns].dtypes))):
+        print('HeaderBand rows differ from the row loop')
+        sys.exit(1)
+
+    def Legacy():
+        return PrettyGantt.DatasetValues(LegacyChartHeader(context)[columns])
+    def Cold():
+        return PrettyGantt.HeaderBand(context).Values(tuple(columns))
+    def Warm():
+        return PrettyGantt.GetHeaderBand(context).Values(tuple(columns))
+
+    print('%-8s %14s' %('header', 'ms per chart'))
+    for label, build in (('loop', Legacy), ('cold', Cold), ('cached', Warm)):
+        seconds, _ = Timed(lambda: [build() for chart in range(args.charts)])
+        print('%-8s %14.3f' %(label, seconds * 1000 / args.charts))
+
+    for bands in (('Y', 'H'), ('H', 'Q'), ('Q', 'W')):
+        table = PrettyGantt.HeaderBand(PrettyGantt.RenderContext(bands = bands)).table
+        print('%s/%s: %s' %(bands[0], bands[1], ', '.join('%d %s' %(count, name) for name, count in table['Program'].value_counts(sort = False).items())))
+
+def BenchMerge(args):
+    # MergeSchedules against processing each file and concatenating the tables file by file
+    directory = tempfile.mkdtemp()
+    json_files = []
+    for i in range(args.files):
+        json_files.append(os.path.join(directory, 'team_%03d.json' %(i)))
+        with open(json_files[-1], 'w') as f:
+            json.dump(GenerateSchedule(args.programs, seed = i), f)
+    context = PrettyGantt.RenderContext()
+    try:
+        def FileByFile():
+            tables = {table: None for table in PrettyGantt.ProgramSchedule.TABLES}
+            for json_file in json_files:
+                ps = PrettyGantt.ProgramSchedule('Benchmark', context)
+                PrettyGantt.LoadSchedule(ps, json_file)
+                for table in tables:
+                    df = getattr(ps, table)
+                    tables[table] = df if (tables[table] is None) else pd.concat([tables[table], df], ignore_index = True)
+            return tables
+        loop_time, expected = Timed(FileByFile)
+        print('%d files x %d programs' %(args.files, args.programs))
+        print('%-22s %10.3f s' %('file by file + concat', loop_time))
+        for workers in args.workers:
+            merge_time, ps = Timed(PrettyGantt.MergeSchedules, json_files, 'Merged', context, workers)
+            # Same rows as the file by file tables, only Index differs
+            same = all(getattr(ps, table).drop(columns = 'Index').equals(expected[table].drop(columns = 'Index'))
+                       for table in PrettyGantt.ProgramSchedule.TABLES)
+            print('%-22s %10.3f s  %s' %('merge, %d workers' %(workers), merge_time, 'same rows' if same else 'ROWS DIFFER'))
+            if (not same):
+                sys.exit(1)
+    finally:
+        shutil.rmtree(directory)
+
+async def PostRender(port, body, fmt):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(('POST /render?fmt=%s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                  %(fmt, len(body))).encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+async def LoadTest(args):
+    service = PrettyGantt.RenderService(workers = args.workers, max_waiting = args.max_waiting, processes = not args.threads)
+    server = await PrettyGantt.ServeGantt('127.0.0.1', 0, service)
+    port = server.sockets[0].getsockname()[1]
+    bodies = [json.dumps(GenerateSchedule(args.programs, seed = i)).encode() for i in range(args.distinct)]
+    rng = random.Random(0)
+    requests = [rng.choice(bodies) for i in range(args.requests)]
+    # Start the workers before timing
+    await PostRender(port, json.dumps(GenerateSchedule(1, seed = -1)).encode(), args.fmt)
+
+    latencies = []
+    statuses = collections.Counter()
+    queue = asyncio.Queue()
+    for body in requests:
+        queue.put_nowait(body)
+    async def Client():
+        while (not queue.empty()):
+            body = queue.get_nowait()
+            start = time.perf_counter()
+            statuses[await PostRender(port, body, args.fmt)] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[Client() for i in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    service.Close()
+
+    print('%d requests (%d distinct schedules of %d programs), %d concurrent, %d %s workers'
+          %(args.requests, args.distinct, args.programs, args.concurrency, args.workers, 'thread' if args.threads else 'process'))
+    print('p50 %.1f ms, p99 %.1f ms, %.1f requests/s' %(np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000, args.requests / elapsed))
+    print('status %s, service %s' %(dict(statuses), dict(service.stats)))
+
+def BenchServe(args):
+    asyncio.run(LoadTest(args))
+
+    # One service reused by later asyncio.run() calls, with more requests than slots
+    service = PrettyGantt.RenderService(workers = 1, max_pending = 1, processes = False)
+    async def Gather(run):
+        bodies = [GenerateSchedule(5, seed = run * 3 + i) for i in range(3)]
+        return await asyncio.gather(*[PrettyGantt.RenderGantt(body, args.fmt, service = service) for body in bodies], return_exceptions = True)
+    try:
+        failed = [output for run in range(2) for output in asyncio.run(Gather(run)) if isinstance(output, Exception)]
+    finally:
+        service.Close()
+    if (failed):
+        print('service reused by a second event loop failed: %r' %(failed[0]))
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'PrettyGantt benchmarks')
+    sub = parser.add_subparsers(dest = 'bench', required = True)
+
+    process = sub.add_parser('process', help = 'ProcessProgramDetails: row loop vs columnar engine')
+    process.add_argument('--rows', type = int, nargs = '+', default = [1000, 10000, 100000])
+    process.set_defaults(func = BenchProcess)
+
+    memory = sub.add_parser('memory', help = 'tracemalloc peak of json.load vs streaming loader')
+    memory.add_argument('--programs', type = int, default = 20000)
+    memory.set_defaults(func = BenchMemory)
+
+    cache = sub.add_parser('cache', help = 'ScheduleCache cold/warm load')
+    cache.add_argument('--programs', type = int, default = 20000)
+    cache.set_defaults(func = BenchCache)
+
+    batch = sub.add_parser('batch', help = 'PlotGanttFiles vs PlotGanttBatch')
+    batch.add_argument('--files', type = int, default = 16)
+    batch.add_argument('--programs', type = int, default = 50)
+    batch.add_argument('--workers', type = int, default = 4)
+    batch.set_defaults(func = BenchBatch)
+
+    repeat = sub.add_parser('repeat', help = 'build many charts in one process, check output and memory stay the same')
+    repeat.add_argument('--charts', type = int, default = 1000)
+    repeat.add_argument('--programs', type = int, default = 20)
+    repeat.add_argument('--threads', type = int, default = 4)
+    repeat.add_argument('--max-growth', type = float, default = 5, help = 'percent of peak RSS after the first 100 charts the rest may add')
+    repeat.add_argument('--fmt', choices = PrettyGantt.ChartRenderer.FORMATS, default = None, help = 'also render every chart')
+    repeat.set_defaults(func = BenchRepeat)
+
+    spec = sub.add_parser('spec', help = 'Vega-Lite spec size and build time')
+    spec.add_argument('--programs', type = int, nargs = '+', default = [10, 100, 1000, 5000])
+    spec.add_argument('--no-prune', action = 'store_true', help = 'keep all table columns in the datasets')
+    spec.add_argument('--repeat', type = int, default = 5)
+    spec.set_defaults(func = BenchSpec)
+
+    startup = sub.add_parser('startup', help = 'import time of the module (python -X importtime)')
+    startup.add_argument('--module', default = 'PrettyGantt')
+    startup.add_argument('--top', type = int, default = 8)
+    startup.set_defaults(func = BenchStartup)
+
+    index = sub.add_parser('index', help = 'interval index window queries vs numpy mask and Python scan')
+    index.add_argument('--phases', type = int, default = 100000)
+    index.add_argument('--queries', type = int, default = 200)
+    index.add_argument('--scan', type = int, default = 5, help = 'windows to check with the Python scan')
+    index.add_argument('--inverted', type = float, default = 0.01, help = 'share of spans with End before Start')
+    index.set_defaults(func = BenchIndex)
+
+    incremental = sub.add_parser('incremental', help = 'full rebuild vs IncrementalSchedule after a few edits')
+    incremental.add_argument('--programs', type = int, default = 3000)
+    incremental.add_argument('--edits', type = int, default = 2)
+    incremental.add_argument('--rounds', type = int, default = 5)
+    incremental.set_defaults(func = BenchIncremental)
+
+    binary = sub.add_parser('binary', help = 'load time and memory of JSON vs BinarySchedule')
+    binary.add_argument('--phases', type = int, default = 1000000)
+    binary.set_defaults(func = BenchBinary)
+
+    merge = sub.add_parser('merge', help = 'MergeSchedules vs loading and concatenating files one by one')
+    merge.add_argument('--files', type = int, default = 200)
+    merge.add_argument('--programs', type = int, default = 15)
+    merge.add_argument('--workers', type = int, nargs = '+', default = [1, 4])
+    merge.set_defaults(func = BenchMerge)
+
+    serve = sub.add_parser('serve', help = 'load test of the local HTTP render service: latency percentiles and throughput')
+    serve.add_argument('--requests', type = int, default = 400)
+    serve.add_argument('--concurrency', type = int, default = 16)
+    serve.add_argument('--distinct', type = int, default = 40, help = 'distinct schedules, repeats hit the cache or coalesce')
+    serve.add_argument('--programs', type = int, default = 20)
+    serve.add_argument('--workers', type = int, default = 2)
+    serve.add_argument('--max-waiting', type = int, default = None, help = 'reject with 503 beyond this many queued renders')
+    serve.add_argument('--threads', action = 'store_true', help = 'render on threads instead of processes')
+    serve.add_argument('--fmt', choices = PrettyGantt.ChartRenderer.FORMATS, default = 'svg')
+    serve.set_defaults(func = BenchServe)
+
+    hooks = sub.add_parser('hooks', help = 'overhead of stage hooks, with and without a collector installed')
+    hooks.add_argument('--programs', type = int, default = 200)
+    hooks.add_argument('--repeat', type = int, default = 20)
+    hooks.set_defaults(func = BenchHooks)
+
+    header = sub.add_parser('header', help = 'chart header rows: row loop vs HeaderBand, cold and cached')
+    header.add_argument('--charts', type = int, default = 500)
+    header.set_defaults(func = BenchHeader)
+
+    stages = sub.add_parser('stages', help = 'time and peak memory of each pipeline stage on a synthetic schedule')
+    stages.add_argument('--programs', type = int, default = 1000)
+    stages.add_argument('--phases', type = int, default = 3, help = 'phases per program')
+    stages.add_argument('--events', type = int, default = 4, help = 'events per program')
+    stages.add_argument('--spread', type = int, default = 600, help = 'days over which programs start')
+    stages.add_argument('--outside', type = float, default = 0.0, help = 'share of programs wholly outside the plotted range')
+    stages.add_argument('--seed', type = int, default = 0)
+    stages.add_argument('--stream', action = 'store_true', help = 'parse with the streaming loader')
+    stages.add_argument('--precompiled', action = 'store_true', help = 'build the spec from the precompiled template')
+    stages.add_argument('--fmt', choices = PrettyGantt.ChartRenderer.FORMATS, default = 'svg', help = 'render format')
+    stages.add_argument('--no-render', dest = 'fmt', action = 'store_const', const = None, help = 'stop after the spec')
+    stages.add_argument('--repeat', type = int, default = 3)
+    stages.add_argument('--output', help = 'write results as JSON to this file')
+    stages.set_defaults(func = BenchStages)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__== '__main__':
+    main()